@@ -1,28 +1,47 @@
 import os
 import psycopg2
-from flask import Flask, jsonify, render_template, request, redirect, url_for, flash, make_response, session
+from flask import Flask, jsonify, render_template, request, redirect, url_for, flash, make_response, session, Response, stream_with_context, g, has_request_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_cors import CORS, cross_origin
 import uuid
-import random
 import requests
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-from supabase import create_client, Client
-from psycopg2.extras import RealDictCursor
+from datetime import datetime, timedelta, date
+from psycopg2.extras import RealDictCursor, Json
+from psycopg2 import extensions as pg_extensions
 import time
 import json
-import base64
+import hashlib
+import hmac
+import threading
+import queue
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque, namedtuple, OrderedDict
+import heapq
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import urllib3
+import gzip
+import tempfile
+from flask.json.provider import DefaultJSONProvider
+from upstream import PRIORITY_LOW, AlpacaClient, CircuitOpenError, RateLimitTimeout, UpstreamClient, UpstreamScheduler, journal_entry
+
+# optional speedups, plain json and gzip are used when these aren't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Suppress InsecureRequestWarning
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-print("--------------------------------------------------")
-print("PenguinTrader Backend Loaded - API Routes Registered")
-print("--------------------------------------------------")
-
 # load environment variables
 load_dotenv()
 
@@ -32,14 +51,480 @@ app = Flask(__name__)
 CORS(app)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "Jacques")
 
-# load stocks data
-try:
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    with open(os.path.join(BASE_DIR, 'stocks.json'), 'r') as f:
-        STOCKS_DATA = json.load(f)
-except Exception as e:
-    print(f"Error loading stocks.json: {e}")
-    STOCKS_DATA = []
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# in-process metrics rendered in the prometheus text format at /metrics
+class Metrics:
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}  # name -> {labels: value}
+        self._gauges = {}
+        self._histograms = {}  # name -> {labels: [bucket counts..., sum, count]}
+        self._buckets = {}
+        self._collectors = []
+
+    def _define(self, store, name, help_text):
+        if name not in store:
+            store[name] = {}
+            self._help[name] = help_text
+
+    def counter(self, name, help_text):
+        with self._lock:
+            self._define(self._counters, name, help_text)
+
+    def gauge(self, name, help_text):
+        with self._lock:
+            self._define(self._gauges, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            self._define(self._histograms, name, help_text)
+            self._buckets[name] = tuple(buckets)
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            series = self._counters.get(name) if name in self._counters else self._gauges[name]
+            series[labels] = series.get(labels, 0) + value
+
+    def dec(self, name, labels=(), value=1):
+        self.inc(name, labels, -value)
+
+    def set(self, name, labels, value):
+        with self._lock:
+            self._gauges[name][labels] = value
+
+    def observe(self, name, labels, value):
+        buckets = self._buckets[name]
+        with self._lock:
+            series = self._histograms[name].get(labels)
+            if series is None:
+                series = self._histograms[name][labels] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    # callback run at scrape time, returns [(name, labels, value)] gauges
+    def collector(self, func):
+        self._collectors.append(func)
+        return func
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for kind, store in (('counter', self._counters), ('gauge', self._gauges)):
+                for name, series in store.items():
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for labels, value in series.items():
+                        lines.append(f"{name}{self._labels(labels)} {value}")
+            for name, series in self._histograms.items():
+                buckets = self._buckets[name]
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, values in series.items():
+                    for bound, count in zip(buckets, values):
+                        lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {values[-1]}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {values[-2]}")
+                    lines.append(f"{name}_count{self._labels(labels)} {values[-1]}")
+            collectors = list(self._collectors)
+
+        for func in collectors:
+            try:
+                for name, labels, value in func():
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+            except Exception as e:
+                print(f"Metrics Collector Error: {e}")
+        return '\n'.join(lines) + '\n'
+
+    # times a block into a histogram, e.g. with metrics.timer('x', (('route', '/'),)):
+    def timer(self, name, labels=()):
+        return _MetricTimer(self, name, labels)
+
+class _MetricTimer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, self.labels, time.perf_counter() - self.started)
+        return False
+
+metrics = Metrics()
+metrics.counter('penguin_http_requests_total', 'HTTP responses by route, method and status')
+metrics.histogram('penguin_http_request_duration_seconds', 'Time spent handling a request')
+metrics.gauge('penguin_http_requests_in_flight', 'Requests currently being handled')
+metrics.histogram('penguin_db_query_duration_seconds', 'Time spent in a single Postgres statement')
+metrics.histogram('penguin_auth_lookup_duration_seconds', 'Time to load the logged in user')
+metrics.histogram('penguin_upstream_request_duration_seconds', 'Time spent waiting on Alpaca or the history backend')
+metrics.counter('penguin_upstream_requests_total', 'Upstream responses by upstream and status')
+metrics.histogram('penguin_json_serialize_seconds', 'Time spent encoding a JSON response body')
+metrics.counter('penguin_response_bytes_total', 'Response body bytes sent by route and content encoding')
+metrics.histogram('penguin_upstream_queue_wait_seconds', 'Time a call waited for an upstream rate limit token', buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+metrics.counter('penguin_upstream_queue_timeouts_total', 'Calls dropped after waiting too long for a rate limit token')
+
+# route template of the current request, so every metric can say where time went
+def current_route():
+    if not has_request_context():
+        return 'background'
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def record_upstream(upstream, operation, started, status):
+    route = current_route()
+    metrics.observe('penguin_upstream_request_duration_seconds', (('upstream', upstream), ('operation', operation), ('route', route)), time.perf_counter() - started)
+    metrics.inc('penguin_upstream_requests_total', (('upstream', upstream), ('status', status)))
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.request_route = current_route()
+    metrics.inc('penguin_http_requests_in_flight', (('route', g.request_route),))
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' in g:
+        metrics.observe('penguin_http_request_duration_seconds', (('route', g.request_route), ('method', request.method)), time.perf_counter() - g.request_started)
+        metrics.inc('penguin_http_requests_total', (('route', g.request_route), ('method', request.method), ('status', str(response.status_code))))
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'request_route' in g:
+        metrics.dec('penguin_http_requests_in_flight', (('route', g.request_route),))
+
+JSON_ENCODER = os.getenv('JSON_ENCODER', 'orjson' if orjson else 'json')
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '4'))
+COMPRESS_CACHE_SIZE = int(os.getenv('COMPRESS_CACHE_SIZE', '256'))
+COMPRESSIBLE_TYPES = {'application/json', 'text/html', 'text/plain', 'text/css', 'text/javascript', 'application/javascript', 'image/svg+xml'}
+
+# jsonify through orjson when it is available, created_at and other datetimes are
+# sent as ISO 8601 strings whichever encoder is in use
+class FastJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+    use_orjson = JSON_ENCODER == 'orjson' and orjson is not None
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def encode(self, obj):
+        if self.use_orjson:
+            return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(obj, default=self.default, ensure_ascii=self.ensure_ascii, separators=(',', ':')).encode()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', self.default)
+            return json.dumps(obj, **kwargs)
+        return self.encode(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        started = time.perf_counter()
+        body = self.encode(obj)
+        metrics.observe('penguin_json_serialize_seconds', (('route', current_route()), ('encoder', 'orjson' if self.use_orjson else 'json')), time.perf_counter() - started)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+app.json_provider_class = FastJSONProvider
+app.json = FastJSONProvider(app)
+
+# compressed bodies of responses with an ETag, keyed by (etag, encoding)
+compressed_cache = OrderedDict()
+compressed_lock = threading.Lock()
+
+def negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted.quality('br') > 0:
+        return 'br'
+    if accepted.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0)
+
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    data = response.get_data()
+    encoding = negotiate_encoding() if len(data) >= COMPRESS_MIN_SIZE else None
+    if encoding is None:
+        metrics.inc('penguin_response_bytes_total', (('route', current_route()), ('encoding', 'identity')), len(data))
+        return response
+
+    etag, weak = response.get_etag()
+    key = (etag, encoding)
+    body = None
+    if etag:
+        with compressed_lock:
+            body = compressed_cache.get(key)
+            if body is not None:
+                compressed_cache.move_to_end(key)
+    if body is None:
+        body = compress_body(data, encoding)
+        if etag:
+            with compressed_lock:
+                compressed_cache[key] = body
+                while len(compressed_cache) > COMPRESS_CACHE_SIZE:
+                    compressed_cache.popitem(last=False)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # the compressed bytes differ from the identity ones, so a strong tag no longer holds
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    metrics.inc('penguin_response_bytes_total', (('route', current_route()), ('encoding', encoding)), len(body))
+    return response
+
+# indexed view of stocks.json, reloaded only when the file changes on disk
+class SymbolRegistry:
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.stocks = []
+        self.by_symbol = {}
+        self.by_sector = {}
+        self.json_bytes = b'[]'
+        self.etag = None
+        self.sector_json = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        now = time.time()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime == self._mtime:
+                    return
+                with open(self.path, 'r') as f:
+                    stocks = json.load(f)
+            except Exception as e:
+                # keep serving the last good copy
+                print(f"Error loading stocks.json: {e}")
+                return
+
+            by_symbol = {}
+            by_sector = {}
+            for stock in stocks:
+                by_symbol[stock['symbol'].upper()] = stock
+                by_sector.setdefault(stock.get('sector') or 'Other', []).append(stock)
+
+            json_bytes = json.dumps(stocks, separators=(',', ':')).encode()
+            # swap everything in at once so readers never see a half built index
+            self.stocks = stocks
+            self.by_symbol = by_symbol
+            self.by_sector = by_sector
+            self.json_bytes = json_bytes
+            self.etag = hashlib.sha1(json_bytes).hexdigest()
+            self.sector_json = {
+                sector: json.dumps(items, separators=(',', ':')).encode()
+                for sector, items in by_sector.items()
+            }
+            self._mtime = mtime
+
+    def get(self, symbol):
+        return self.by_symbol.get(symbol.upper()) if symbol else None
+
+    def sector(self, name):
+        return self.by_sector.get(name, [])
+
+symbol_registry = SymbolRegistry(os.path.join(BASE_DIR, 'stocks.json'))
+
+SEARCH_DEFAULT_LIMIT = int(os.getenv('SEARCH_DEFAULT_LIMIT', '10'))
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', '50'))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '2048'))
+
+SEARCH_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+def search_tokens(text):
+    return SEARCH_TOKEN_PATTERN.findall(str(text).lower())
+
+def trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrieNode:
+    __slots__ = ('children', 'ids')
+
+    def __init__(self):
+        self.children = {}
+        self.ids = []
+
+# one built search index, never modified once published
+SearchData = namedtuple('SearchData', ['etag', 'entries', 'symbols', 'symbol_trie', 'name_trie', 'name_tokens', 'grams'])
+
+# symbol/company name search over the symbol registry, rebuilt when stocks.json changes.
+# entries are numbered shortest name first, so every posting list is already in
+# tie-break order and a name lookup can stop as soon as it has enough matches
+class SymbolSearchIndex:
+    EXACT = 1000
+    SYMBOL_PREFIX = 800
+    NAME_START = 600
+    NAME_TOKEN = 500
+    FUZZY = 300
+
+    def __init__(self, registry, cache_size=2048):
+        self.registry = registry
+        self.cache_size = cache_size
+        self._data = SearchData(None, [], {}, TrieNode(), TrieNode(), [], {})
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _build(self, etag, stocks):
+        entries = sorted(
+            ({'symbol': s['symbol'].upper(), 'name': s.get('name', ''), 'sector': s.get('sector'), 'domain': s.get('domain')} for s in stocks if s.get('symbol')),
+            key=lambda e: (len(search_tokens(e['name'])), len(e['symbol']), e['symbol'])
+        )
+        symbols = {}
+        symbol_trie = TrieNode()
+        name_trie = TrieNode()
+        grams = {}
+        name_tokens = []
+        for i, entry in enumerate(entries):
+            symbol = entry['symbol'].lower()
+            tokens = search_tokens(entry['name'])
+            symbols.setdefault(symbol, i)
+            name_tokens.append(tokens)
+            self._insert(symbol_trie, symbol, i)
+            for token in tokens:
+                self._insert(name_trie, token, i)
+            for gram in trigrams(symbol) | trigrams(' '.join(tokens)):
+                grams.setdefault(gram, []).append(i)
+        return SearchData(etag, entries, symbols, symbol_trie, name_trie, name_tokens, grams)
+
+    @staticmethod
+    def _insert(root, word, i):
+        node = root
+        for ch in word:
+            node = node.children.get(ch) or node.children.setdefault(ch, TrieNode())
+            # ids arrive in order, so a repeat can only be the last one
+            if not node.ids or node.ids[-1] != i:
+                node.ids.append(i)
+
+    @staticmethod
+    def _walk(root, prefix):
+        node = root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        return node.ids
+
+    # a rebuild is published with a single assignment, so a search that took the
+    # previous index keeps a consistent copy of it until it finishes
+    def _current(self):
+        self.registry.refresh()
+        etag = self.registry.etag
+        if etag != self._data.etag:
+            with self._lock:
+                if etag != self._data.etag:
+                    self._data = self._build(etag, self.registry.stocks)
+                    self._cache.clear()
+        return self._data
+
+    def search(self, query, limit=10):
+        data = self._current()
+        entries = data.entries
+        tokens = search_tokens(query)
+        if not tokens:
+            return []
+        # the etag keeps a search that finishes after a rebuild from caching old results
+        key = (data.etag, ' '.join(tokens), limit)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+
+        scores = {}
+
+        def score(i, value):
+            if value > scores.get(i, 0):
+                scores[i] = value
+
+        compact = ''.join(tokens)
+        exact = data.symbols.get(compact)
+        if exact is not None:
+            score(exact, self.EXACT)
+        # shorter symbols are closer to what was typed
+        for i in heapq.nsmallest(limit + 1, self._walk(data.symbol_trie, compact), key=lambda i: (len(entries[i]['symbol']), i)):
+            score(i, self.SYMBOL_PREFIX - len(entries[i]['symbol']))
+
+        # every query token has to start some word of the company name, candidates come
+        # from the rarest token and the rest are checked against that entry's words
+        rarest = min(range(len(tokens)), key=lambda t: len(self._walk(data.name_trie, tokens[t])))
+        rest = tokens[:rarest] + tokens[rarest + 1:]
+        starts_found = 0
+        for i in self._walk(data.name_trie, tokens[rarest]):
+            words = data.name_tokens[i]
+            if not all(any(word.startswith(token) for word in words) for token in rest):
+                continue
+            if words[0].startswith(tokens[0]):
+                score(i, self.NAME_START)
+                starts_found += 1
+                # later ids can only tie at best, and ties go to the lower id
+                if starts_found >= limit:
+                    break
+            else:
+                score(i, self.NAME_TOKEN)
+
+        # typos and substrings fall back to trigram overlap
+        if len(scores) < limit and len(compact) >= 3:
+            wanted = trigrams(' '.join(tokens))
+            hits = {}
+            for gram in wanted:
+                for i in data.grams.get(gram, ()):
+                    hits[i] = hits.get(i, 0) + 1
+            for i, count in hits.items():
+                overlap = count / len(wanted)
+                if overlap >= 0.5:
+                    score(i, int(self.FUZZY * overlap))
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        results = [dict(entries[i], score=value) for i, value in ranked]
+        with self._lock:
+            self._cache[key] = results
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return results
+
+symbol_search = SymbolSearchIndex(symbol_registry, cache_size=SEARCH_CACHE_SIZE)
 
 # initialize flask-login
 login_manager = LoginManager()
@@ -55,52 +540,92 @@ class User(UserMixin):
         self.last_name = last_name
         self.alpaca_account_id = alpaca_account_id
 
+# per-process cache of User objects so @login_required doesn't hit the db every request
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1024'))
+# users still waiting on their trading account are only cached briefly, the job that
+# attaches it may run in another process whose invalidate_user can't reach this cache
+USER_PENDING_CACHE_TTL = float(os.getenv('USER_PENDING_CACHE_TTL', '2'))
+
+class UserCache:
+    def __init__(self, ttl=60, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # user_id -> (expires_at, user)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            # mark as most recently used
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id, user, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.time() + ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+user_cache = UserCache(ttl=USER_CACHE_TTL, maxsize=USER_CACHE_SIZE)
+
+def cache_user(user):
+    user_cache.set(user.id, user, ttl=None if user.alpaca_account_id else USER_PENDING_CACHE_TTL)
+
+# call whenever a user's row changes so the next request reloads it
+def invalidate_user(user_id):
+    user_cache.invalidate(user_id)
+
 @login_manager.user_loader
 def load_user(user_id):
-    conn = get_supabase_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE user_id = %s", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
-    
-    if user:
-        # Check if alpaca_account_id column exists in the row (it should be the last one if we added it)
-        # Using a safer dict approach via RealDictCursor is better, but here we used tuple index.
-        # Assuming schema: user_id, email, first_name, last_name, password_hash, terms, created_at, reset_code, alpaca_account_id
-        # Let's check init_supabase_db to see the original index.
-        # Original: user_id(0), email(1), first_name (missing in create table?), last_name (missing?).
-        # Wait, the init_supabase_db logic in line 123 only has user_id, email, password_hash, created_at.
-        # BUT the login logic uses user[2], user[3] for names.
-        # This implies the DB schema in production/running is different from init_supabase_db function or I misread.
-        # Let's depend on the query.
-        # To be safe, we should probably switch to RealDictCursor or named attributes if possible, but let's stick to the current pattern.
-        # We'll assume alpaca_account_id is fetched.
-        # Since I can't know the exact index without `SELECT *`, I'll update the query to be explicit.
-        
-        # Explicit query is safer:
-        # SELECT user_id, email, first_name, last_name, alpaca_account_id FROM users ...
-        pass
-    
-    # Re-implementing load_user to be safer and include alpaca_id
-    conn = get_supabase_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor) # Use RealDictCursor
-    cursor.execute("SELECT user_id, email, first_name, last_name, alpaca_account_id FROM users WHERE user_id = %s", (user_id,))
-    user_data = cursor.fetchone()
-    conn.close()
+    started = time.perf_counter()
+    user = user_cache.get(user_id)
+    if user is not None:
+        metrics.observe('penguin_auth_lookup_duration_seconds', (('cache', 'hit'),), time.perf_counter() - started)
+        return user
+
+    with metrics.timer('penguin_auth_lookup_duration_seconds', (('cache', 'miss'),)), get_supabase_connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("SELECT user_id, email, first_name, last_name, alpaca_account_id FROM users WHERE user_id = %s", (user_id,))
+        user_data = cursor.fetchone()
     
     if user_data:
-        return User(
+        user = User(
             user_data['user_id'], 
             user_data['email'], 
             user_data['first_name'], 
             user_data['last_name'],
             user_data.get('alpaca_account_id')
         )
+        cache_user(user)
+        return user
     return None
 
 # Supabase configuration
-SUPABASE_URL = os.getenv('SUPABASE_URL')
-SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 SUPABASE_DB_URL = os.getenv('SUPABASE_DB_URL')
 
 # alpaca broker configuration
@@ -108,30 +633,235 @@ ALPACA_BROKER_URL = os.getenv('ALPACA_BROKER_URL', 'https://broker-api.sandbox.a
 ALPACA_BROKER_KEY = os.getenv('ALPACA_BROKER_KEY')
 ALPACA_BROKER_SECRET = os.getenv('ALPACA_BROKER_SECRET')
 
-def get_alpaca_headers():
-    return {
-        "Authorization": f"Basic {base64.b64encode(f'{ALPACA_BROKER_KEY}:{ALPACA_BROKER_SECRET}'.encode()).decode()}"
-    }
+ALPACA_POOL_SIZE = int(os.getenv('ALPACA_POOL_SIZE', '10'))
+ALPACA_CONNECT_TIMEOUT = float(os.getenv('ALPACA_CONNECT_TIMEOUT', '3.05'))
+ALPACA_READ_TIMEOUT = float(os.getenv('ALPACA_READ_TIMEOUT', '10'))
+ALPACA_MAX_RETRIES = int(os.getenv('ALPACA_MAX_RETRIES', '3'))
+ALPACA_RETRY_BACKOFF = float(os.getenv('ALPACA_RETRY_BACKOFF', '0.3'))
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+
+ALPACA_RATE_LIMIT = float(os.getenv('ALPACA_RATE_LIMIT', '1000'))
+ALPACA_DATA_RATE_LIMIT = float(os.getenv('ALPACA_DATA_RATE_LIMIT', '200'))
+ALPACA_RATE_BURST = float(os.getenv('ALPACA_RATE_BURST', '20'))
+ALPACA_RATE_RESERVE = float(os.getenv('ALPACA_RATE_RESERVE', '5'))
+ALPACA_RATE_STATE_DIR = os.getenv('ALPACA_RATE_STATE_DIR', tempfile.gettempdir())
+ALPACA_QUEUE_TIMEOUT = float(os.getenv('ALPACA_QUEUE_TIMEOUT', '10'))
+
+# a rate limit of 0 turns the scheduler off
+def make_scheduler(name, rate_per_minute):
+    if rate_per_minute <= 0:
+        return None
+    return UpstreamScheduler(
+        name,
+        rate_per_minute,
+        burst=ALPACA_RATE_BURST,
+        reserve=ALPACA_RATE_RESERVE,
+        state_dir=ALPACA_RATE_STATE_DIR,
+        timeout=ALPACA_QUEUE_TIMEOUT,
+        metrics=metrics
+    )
+
+# breaker settings and metrics shared by every upstream client the app creates
+UPSTREAM_OPTIONS = {
+    'failure_threshold': CIRCUIT_FAILURE_THRESHOLD,
+    'reset_timeout': CIRCUIT_RESET_TIMEOUT,
+    'recorder': record_upstream
+}
+
+alpaca = AlpacaClient(
+    ALPACA_BROKER_URL,
+    ALPACA_BROKER_KEY,
+    ALPACA_BROKER_SECRET,
+    pool_size=ALPACA_POOL_SIZE,
+    connect_timeout=ALPACA_CONNECT_TIMEOUT,
+    read_timeout=ALPACA_READ_TIMEOUT,
+    max_retries=ALPACA_MAX_RETRIES,
+    backoff=ALPACA_RETRY_BACKOFF,
+    scheduler=make_scheduler('alpaca', ALPACA_RATE_LIMIT),
+    **UPSTREAM_OPTIONS
+)
+
+# market data lives on a separate host but takes the same broker credentials
+ALPACA_DATA_URL = os.getenv('ALPACA_DATA_URL', 'https://data.sandbox.alpaca.markets/v2')
+
+alpaca_data = AlpacaClient(
+    ALPACA_DATA_URL,
+    ALPACA_BROKER_KEY,
+    ALPACA_BROKER_SECRET,
+    pool_size=ALPACA_POOL_SIZE,
+    connect_timeout=ALPACA_CONNECT_TIMEOUT,
+    read_timeout=ALPACA_READ_TIMEOUT,
+    max_retries=ALPACA_MAX_RETRIES,
+    backoff=ALPACA_RETRY_BACKOFF,
+    name='alpaca_data',
+    scheduler=make_scheduler('alpaca_data', ALPACA_DATA_RATE_LIMIT),
+    **UPSTREAM_OPTIONS
+)
+
+# short lived cache where concurrent misses for the same key share one upstream call
+class SingleFlightCache:
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self, ttl, should_cache=None):
+        self.ttl = ttl
+        self.should_cache = should_cache or (lambda value: True)
+        self._entries = {}  # key -> (expires_at, value)
+        self._calls = {}  # key -> _Call currently fetching
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                call = self._calls[key] = self._Call()
+                generation = self._generations.get(key, 0)
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = loader()
+        except Exception as e:
+            call.error = e
+        finally:
+            with self._lock:
+                del self._calls[key]
+                # skip storing if the key was invalidated while we were fetching
+                if call.error is None and self.ttl > 0 and self._generations.get(key, 0) == generation and self.should_cache(call.result):
+                    self._entries[key] = (time.time() + self.ttl, call.result)
+            call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced}
+
+ACCOUNT_CACHE_TTL = float(os.getenv('ACCOUNT_CACHE_TTL', '2'))
+
+# only successful responses are cached, errors are shared with waiters but not kept
+account_cache = SingleFlightCache(ACCOUNT_CACHE_TTL, should_cache=lambda response: response.status_code == 200)
+
+# /api/account_info and /api/portfolio both read this endpoint, the stream poller too at low priority
+def fetch_trading_account(alpaca_id, priority=None):
+    return account_cache.get(alpaca_id, lambda: alpaca.get(f"/trading/accounts/{alpaca_id}/account", priority=priority))
+
+STALE_MAX_AGE = float(os.getenv('STALE_MAX_AGE', '900'))
+STALE_CACHE_SIZE = int(os.getenv('STALE_CACHE_SIZE', '2048'))
+
+# last successful upstream response per key, served with its age when the upstream
+# is failing or its circuit is open
+class LastKnownGood:
+    def __init__(self, max_age=900, max_entries=2048):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (stored_at, response)
+        self._lock = threading.Lock()
+        self.served = 0
+
+    def _fallback(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.max_age:
+                return None
+            self.served += 1
+            return entry
+
+    # returns (response, age in seconds or None when the response is fresh)
+    def fetch(self, key, loader):
+        try:
+            response = loader()
+        except requests.RequestException:
+            entry = self._fallback(key)
+            if entry is None:
+                raise
+            return entry[1], time.time() - entry[0]
+
+        if response.status_code == 200:
+            with self._lock:
+                self._entries[key] = (time.time(), response)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        elif response.status_code >= 500:
+            entry = self._fallback(key)
+            if entry is not None:
+                return entry[1], time.time() - entry[0]
+        return response, None
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'served': self.served}
+
+last_known_good = LastKnownGood(STALE_MAX_AGE, STALE_CACHE_SIZE)
+
+def mark_stale(response, age):
+    if age is not None:
+        response.headers['X-Data-Stale'] = 'true'
+        response.headers['X-Data-Age'] = str(int(age))
+    return response
+
+def upstream_unavailable(error):
+    response = jsonify({'error': 'Upstream unavailable', 'upstream': error.upstream})
+    response.headers['Retry-After'] = str(max(1, int(error.retry_after + 0.5)))
+    return response, 503
+
+# firm account every signup JNLC journal is paid from
+FUNDING_ACCOUNT_ID = os.getenv('ALPACA_FUNDING_ACCOUNT_ID', '9896d9b1-fb81-335b-b527-9048f681465f')
+SIGNUP_FUNDING_AMOUNT = '50000'
+
+# the signup journal an earlier attempt already sent, None if there isn't one yet
+def find_signup_journal(alpaca_id):
+    response = alpaca.get("/journals", params={'to_account': alpaca_id, 'entry_type': 'JNLC'})
+    if response.status_code != 200:
+        raise requests.RequestException(f"Journal lookup failed: {response.status_code} {response.text}")
+    for journal in response.json():
+        if journal.get('from_account') == FUNDING_ACCOUNT_ID and journal.get('status') not in ('rejected', 'canceled', 'refused'):
+            return journal
+    return None
 
 # fund the new account with 50k
 def fund_new_account(alpaca_id):
     try:
-        # Wait a moment for the account to be fully active in Sandbox
-        time.sleep(1)
-        
-        payload = {
-            "entry_type": "JNLC",
-            "from_account": "9896d9b1-fb81-335b-b527-9048f681465f",
-            "to_account": alpaca_id,
-            "amount": "50000",
-            "description": "Initial Signup Balance"
-        }
+        # a timeout or 5xx on an earlier attempt may still have moved the money,
+        # so never post a second journal without checking for the first
+        existing = find_signup_journal(alpaca_id)
+        if existing is not None:
+            print(f"Account {alpaca_id} already funded by journal {existing.get('id')}")
+            return True
+
+        payload = journal_entry(alpaca_id, SIGNUP_FUNDING_AMOUNT, "Initial Signup Balance", from_account=FUNDING_ACCOUNT_ID)
         
-        response = requests.post(
-            f"{ALPACA_BROKER_URL}/journals",
-            json=payload,
-            headers=get_alpaca_headers()
-        )
+        response = alpaca.post("/journals", json=payload)
         
         if response.status_code in [200, 201]:
             print(f"Account {alpaca_id} funded with $50,000")
@@ -150,159 +880,667 @@ def get_account_info():
     if not current_user.alpaca_account_id:
         return jsonify({'error': 'No trading account found'}), 400
         
+    alpaca_id = current_user.alpaca_account_id
     try:
-        response = requests.get(
-            f"{ALPACA_BROKER_URL}/trading/accounts/{current_user.alpaca_account_id}/account",
-            headers=get_alpaca_headers()
-        )
+        response, stale_age = last_known_good.fetch(('account', alpaca_id), lambda: fetch_trading_account(alpaca_id))
         
         if response.status_code == 200:
             data = response.json()
             # Extract relevant fields
-            return jsonify({
+            return mark_stale(jsonify({
                 'cash': data.get('cash'),
                 'buying_power': data.get('buying_power'),
                 'equity': data.get('equity'),
                 'currency': data.get('currency', 'USD')
-            })
+            }), stale_age)
         else:
             return jsonify({'error': 'Failed to fetch account info', 'details': response.text}), response.status_code
             
+    except (CircuitOpenError, RateLimitTimeout) as e:
+        return upstream_unavailable(e)
     except Exception as e:
         print(f"Account Info Error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
-# initialize supabase client
-supabase = None
-if SUPABASE_URL and SUPABASE_KEY:
-    try:
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    except Exception as e:
-        print(f"Warning: Failed to initialize Supabase client: {e}")
-        supabase = None
+# connection pool settings
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '1800'))
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', '30'))
+
+class PoolTimeout(Exception):
+    pass
+
+# wraps a raw psycopg2 connection so close() hands it back to the pool
+class PooledConnection:
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        if self._released:
+            # the raw connection may already belong to another request
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self.__getattr__('cursor')(*args, **kwargs))
+
+    # error handlers roll back unconditionally, which is a no-op once returned
+    def rollback(self):
+        if not self._released:
+            self._raw.rollback()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._raw, self._created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self._raw.closed:
+                pass
+            elif exc_type is None:
+                self._raw.commit()
+            else:
+                self._raw.rollback()
+        finally:
+            self.close()
+        return False
 
-# connect to supabase
-def get_supabase_connection():
-    return psycopg2.connect(SUPABASE_DB_URL)
+# records how long each statement takes, labelled with the route that ran it
+class TimedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed(self, method, query, args):
+        started = time.perf_counter()
+        try:
+            return method(query, args)
+        finally:
+            words = query.split(None, 1) if isinstance(query, str) else []
+            operation = words[0].upper() if words else 'OTHER'
+            metrics.observe('penguin_db_query_duration_seconds', (('route', current_route()), ('operation', operation)), time.perf_counter() - started)
+
+    def execute(self, query, args=None):
+        return self._timed(self._cursor.execute, query, args)
+
+    def executemany(self, query, args_list):
+        return self._timed(self._cursor.executemany, query, args_list)
+
+# keeps up to `size` idle connections open and allows `max_overflow` extra ones under load
+class ConnectionPool:
+    def __init__(self, dsn, size=5, max_overflow=10, timeout=10, max_lifetime=1800, ping_after=30):
+        self.dsn = dsn
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self._idle = deque()  # (raw, created_at, returned_at)
+        self._open = 0
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._stats = {
+            'checkouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'discarded': 0,
+            'failed_pings': 0,
+            'timeouts': 0,
+            'wait_seconds_total': 0.0
+        }
 
-def init_supabase_db():
-    conn = get_supabase_connection()
-    cursor = conn.cursor()
-    
-    # create users table
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                        user_id TEXT PRIMARY KEY,
-                        email TEXT UNIQUE NOT NULL,
-                        password_hash TEXT NOT NULL,
-                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP)''')
-    
-    # create watchlist table
-    cursor.execute('''CREATE TABLE IF NOT EXISTS watchlist (
-                        watchlist_id TEXT PRIMARY KEY,
-                        user_id TEXT NOT NULL,
-                        watchlist_name TEXT NOT NULL,
-                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users(user_id))''')
-    
-    # create watchlist items table
-    cursor.execute('''CREATE TABLE IF NOT EXISTS watchlist_items (
-                        watchlist_id TEXT NOT NULL,
-                        stock_symbol TEXT NOT NULL,
-                        added_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                        PRIMARY KEY (watchlist_id, stock_symbol),
-                        FOREIGN KEY (watchlist_id) REFERENCES watchlist(watchlist_id))''')
+    def _connect(self):
+        raw = psycopg2.connect(self.dsn)
+        with self._lock:
+            self._stats['created'] += 1
+        return raw, time.time()
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, raw, created_at, returned_at):
+        if raw.closed:
+            return False
+        now = time.time()
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            with self._lock:
+                self._stats['recycled'] += 1
+            return False
+        # only ping connections that have sat idle long enough to have gone stale
+        if now - returned_at >= self.ping_after:
+            try:
+                cursor = raw.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+                raw.rollback()
+            except Exception:
+                with self._lock:
+                    self._stats['failed_pings'] += 1
+                return False
+        return True
+
+    def getconn(self):
+        started = time.time()
+        deadline = started + self.timeout
+        while True:
+            with self._lock:
+                while not self._idle and self._open >= self.size + self.max_overflow:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                    self._available.wait(remaining)
+
+                if self._idle:
+                    raw, created_at, returned_at = self._idle.pop()
+                else:
+                    raw = None
+                    self._open += 1
+                self._in_use += 1
+
+            if raw is not None:
+                if self._is_healthy(raw, created_at, returned_at):
+                    break
+                self._discard(raw)
+                with self._lock:
+                    self._stats['discarded'] += 1
+                    self._open -= 1
+                    self._in_use -= 1
+                    self._available.notify()
+                continue
+
+            try:
+                raw, created_at = self._connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                    self._in_use -= 1
+                    self._available.notify()
+                raise
+            break
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['wait_seconds_total'] += time.time() - started
+        return PooledConnection(self, raw, created_at)
+
+    def _release(self, raw, created_at):
+        keep = not raw.closed
+        if keep:
+            try:
+                # never hand out a connection with a half finished transaction
+                if raw.get_transaction_status() != pg_extensions.TRANSACTION_STATUS_IDLE:
+                    raw.rollback()
+            except Exception:
+                keep = False
+
+        with self._lock:
+            self._in_use -= 1
+            if keep and len(self._idle) < self.size:
+                self._idle.append((raw, created_at, time.time()))
+            else:
+                self._open -= 1
+                if not keep:
+                    self._stats['discarded'] += 1
+                keep = False
+            self._available.notify()
+
+        if not keep:
+            self._discard(raw)
+
+    def closeall(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+        for raw, _, _ in idle:
+            self._discard(raw)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'overflow': max(0, self._open - self.size)
+            })
+        checkouts = stats['checkouts']
+        stats['avg_wait_ms'] = round(stats['wait_seconds_total'] * 1000 / checkouts, 3) if checkouts else 0.0
+        return stats
+
+db_pool = ConnectionPool(
+    SUPABASE_DB_URL,
+    size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_MAX_OVERFLOW,
+    timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    ping_after=DB_POOL_PING_AFTER
+)
+
+# connect to supabase (borrows from the pool, close() returns it)
+def get_supabase_connection():
+    return db_pool.getconn()
+
+# schema changes, applied in order by `flask --app app migrate` and never edited once released
+MIGRATIONS = [
+    (1, 'create users, watchlist and watchlist_items', [
+        '''CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS watchlist (
+                watchlist_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                watchlist_name TEXT NOT NULL,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(user_id))''',
+        '''CREATE TABLE IF NOT EXISTS watchlist_items (
+                watchlist_id TEXT NOT NULL,
+                stock_symbol TEXT NOT NULL,
+                added_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (watchlist_id, stock_symbol),
+                FOREIGN KEY (watchlist_id) REFERENCES watchlist(watchlist_id))'''
+    ]),
+    # columns the routes rely on (already present on the hosted database, needed for a fresh one)
+    (2, 'add profile, trading account and ordering columns', [
+        '''ALTER TABLE users ADD COLUMN IF NOT EXISTS first_name TEXT''',
+        '''ALTER TABLE users ADD COLUMN IF NOT EXISTS last_name TEXT''',
+        '''ALTER TABLE users ADD COLUMN IF NOT EXISTS terms BOOLEAN''',
+        '''ALTER TABLE users ADD COLUMN IF NOT EXISTS reset_code TEXT''',
+        '''ALTER TABLE users ADD COLUMN IF NOT EXISTS alpaca_account_id TEXT''',
+        '''ALTER TABLE watchlist ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP''',
+        '''ALTER TABLE watchlist ADD COLUMN IF NOT EXISTS position INTEGER DEFAULT 0''',
+        '''ALTER TABLE watchlist_items ADD COLUMN IF NOT EXISTS watchlist_item_id TEXT''',
+        '''ALTER TABLE watchlist_items ADD COLUMN IF NOT EXISTS position INTEGER DEFAULT 0'''
+    ]),
+    # bumped on every watchlist change so /api/watchlists can answer 304
+    (3, 'add users.watchlist_version', [
+        '''ALTER TABLE users ADD COLUMN IF NOT EXISTS watchlist_version BIGINT NOT NULL DEFAULT 0'''
+    ]),
+    # background jobs (alpaca provisioning after signup)
+    (4, 'create jobs', [
+        '''CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                job_type TEXT NOT NULL,
+                user_id TEXT,
+                payload JSONB NOT NULL DEFAULT '{}',
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 5,
+                last_error TEXT,
+                run_after TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP)''',
+        '''CREATE INDEX IF NOT EXISTS jobs_status_run_after_idx ON jobs (status, run_after)''',
+        '''CREATE INDEX IF NOT EXISTS jobs_user_id_idx ON jobs (user_id)'''
+    ]),
+    # lets item inserts use ON CONFLICT DO NOTHING instead of checking first
+    (5, 'unique watchlist item per symbol', [
+        '''CREATE UNIQUE INDEX IF NOT EXISTS watchlist_items_watchlist_symbol_idx ON watchlist_items (watchlist_id, stock_symbol)'''
+    ]),
+    # symbols are stored upper case, folds rows added as e.g. 'aapl' into their 'AAPL' twin
+    (6, 'upper case watchlist symbols', [
+        '''DELETE FROM watchlist_items a USING watchlist_items b
+           WHERE a.watchlist_id = b.watchlist_id
+             AND UPPER(TRIM(a.stock_symbol)) = UPPER(TRIM(b.stock_symbol))
+             AND (COALESCE(a.position, 0), a.ctid) > (COALESCE(b.position, 0), b.ctid)''',
+        '''UPDATE watchlist_items SET stock_symbol = UPPER(TRIM(stock_symbol))
+           WHERE stock_symbol <> UPPER(TRIM(stock_symbol))'''
+    ])
+]
+
+# arbitrary key so two deploys can't migrate at the same time
+MIGRATION_LOCK_ID = 4207311
+
+def run_migrations():
+    applied = []
+    with get_supabase_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            cursor.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+                                version INTEGER PRIMARY KEY,
+                                name TEXT NOT NULL,
+                                applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP)''')
+            conn.commit()
 
+            cursor.execute("SELECT version FROM schema_migrations")
+            done = {row[0] for row in cursor.fetchall()}
+
+            # each migration commits on its own so a failure leaves earlier ones applied
+            for version, name, statements in MIGRATIONS:
+                if version in done:
+                    continue
+                try:
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    print(f"Migration {version} ({name}) failed")
+                    raise
+                print(f"Applied migration {version}: {name}")
+                applied.append(version)
+        finally:
+            # the advisory lock is held by the session, so it survives the rollback
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+    return applied
+
+@app.cli.command('migrate')
+def migrate_command():
+    applied = run_migrations()
+    if not applied:
+        print("Database schema is up to date.")
+
+# must run inside the same transaction as the watchlist change it records
+def bump_watchlist_version(cursor, user_id):
+    cursor.execute("UPDATE users SET watchlist_version = watchlist_version + 1 WHERE user_id = %s", (user_id,))
+
+def watchlist_etag(user_id, version):
+    return f"wl-{user_id}-{version}"
+
+
+# background job settings, serverless hosts (vercel sets VERCEL=1) freeze threads started
+# from a request once the response is sent, so there the queue is driven by the /api/jobs
+# poll and the cron endpoint, or by a dedicated worker
+SERVERLESS = bool(os.getenv('VERCEL'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '0' if SERVERLESS else '2'))
+JOB_RUN_ON_POLL = os.getenv('JOB_RUN_ON_POLL', 'true' if SERVERLESS else 'false').lower() in ('1', 'true', 'yes')
+JOB_RUN_BUDGET = float(os.getenv('JOB_RUN_BUDGET', '8'))
+CRON_SECRET = os.getenv('CRON_SECRET')
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+JOB_RETRY_BACKOFF = float(os.getenv('JOB_RETRY_BACKOFF', '2'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '5'))
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', '300'))
+
+class JobError(Exception):
+    pass
+
+JOB_HANDLERS = {}
+
+def job_handler(job_type):
+    def register(func):
+        JOB_HANDLERS[job_type] = func
+        return func
+    return register
+
+# inserts a job using the caller's cursor so it commits with the caller's transaction
+def enqueue_job(cursor, job_type, payload, user_id=None, delay=0):
+    job_id = str(uuid.uuid4())
+    cursor.execute("""
+        INSERT INTO jobs (job_id, job_type, user_id, payload, max_attempts, run_after)
+        VALUES (%s, %s, %s, %s, %s, NOW() + %s * INTERVAL '1 second')
+    """, (job_id, job_type, user_id, Json(payload), JOB_MAX_ATTEMPTS, delay))
+    return job_id
+
+job_wakeup = threading.Event()
+
+def notify_job_workers():
+    job_wakeup.set()
+
+def claim_job(user_id=None):
+    with get_supabase_connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        # SKIP LOCKED lets several workers (threads or processes) share the table,
+        # running jobs left behind by a crashed worker are picked up again once stale
+        cursor.execute("""
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, updated_at = NOW()
+            WHERE job_id = (
+                SELECT job_id FROM jobs
+                WHERE ((status = 'queued' AND run_after <= NOW())
+                    OR (status = 'running' AND updated_at < NOW() - %s * INTERVAL '1 second'))
+                  AND (%s::text IS NULL OR user_id = %s)
+                ORDER BY run_after
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING job_id, job_type, user_id, payload, attempts, max_attempts
+        """, (JOB_STALE_AFTER, user_id, user_id))
+        return cursor.fetchone()
+
+def finish_job(job, error=None):
+    with get_supabase_connection() as conn:
+        cursor = conn.cursor()
+        if error is None:
+            cursor.execute("UPDATE jobs SET status = 'done', last_error = NULL, updated_at = NOW() WHERE job_id = %s", (job['job_id'],))
+        elif job['attempts'] >= job['max_attempts']:
+            cursor.execute("UPDATE jobs SET status = 'failed', last_error = %s, updated_at = NOW() WHERE job_id = %s", (error, job['job_id']))
+        else:
+            # exponential backoff between attempts
+            delay = JOB_RETRY_BACKOFF * (2 ** (job['attempts'] - 1))
+            cursor.execute("""
+                UPDATE jobs
+                SET status = 'queued', last_error = %s, run_after = NOW() + %s * INTERVAL '1 second', updated_at = NOW()
+                WHERE job_id = %s
+            """, (error, delay, job['job_id']))
 
+def run_job(job):
+    handler = JOB_HANDLERS.get(job['job_type'])
+    try:
+        if handler is None:
+            raise JobError(f"Unknown job type {job['job_type']}")
+        handler(job['payload'])
+    except Exception as e:
+        print(f"Job {job['job_type']} {job['job_id']} failed (attempt {job['attempts']}): {e}")
+        finish_job(job, str(e))
+        return False
+    finish_job(job)
+    return True
+
+class JobWorker(threading.Thread):
+    def __init__(self, name=None):
+        super().__init__(name=name, daemon=True)
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                job = claim_job()
+            except Exception as e:
+                print(f"Job Worker Error: {e}")
+                job = None
+            if job is not None:
+                run_job(job)
+                continue
+            job_wakeup.wait(JOB_POLL_INTERVAL)
+            job_wakeup.clear()
+
+    def stop(self):
+        self.stopping.set()
+        job_wakeup.set()
+
+job_workers = []
+job_workers_lock = threading.Lock()
+
+def ensure_job_workers(count=JOB_WORKERS):
+    if job_workers or count <= 0:
+        return
+    with job_workers_lock:
+        if job_workers:
+            return
+        for i in range(count):
+            worker = JobWorker(name=f"job-worker-{i}")
+            worker.start()
+            job_workers.append(worker)
+
+@app.before_request
+def start_job_workers():
+    ensure_job_workers()
+
+# runs jobs that are already due in the current request, for processes without worker threads,
+# never waits for a delayed job and stops claiming once `budget` seconds have gone by
+def run_due_jobs(user_id=None, max_jobs=5, budget=JOB_RUN_BUDGET):
+    started = time.monotonic()
+    ran = 0
+    while ran < max_jobs and time.monotonic() - started < budget:
+        job = claim_job(user_id=user_id)
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+# vercel cron calls this with Authorization: Bearer $CRON_SECRET, so failed attempts are
+# retried even if the user never polls again. Without CRON_SECRET it stays closed
+@app.route('/api/jobs/run', methods=['GET', 'POST'])
+def run_jobs_cron():
+    if not CRON_SECRET or request.headers.get('Authorization') != f"Bearer {CRON_SECRET}":
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        ran = run_due_jobs(max_jobs=50)
+    except Exception as e:
+        print(f"Cron Job Error: {e}")
+        return jsonify({'error': 'Failed to run jobs'}), 500
+    return jsonify({'success': True, 'ran': ran})
+
+@app.cli.command('worker')
+def run_job_worker_command():
+    # dedicated worker process: flask --app app worker
+    ensure_job_workers(max(JOB_WORKERS, 1))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for worker in job_workers:
+            worker.stop()
+
+def build_alpaca_account_payload(email, first_name, last_name):
+    # uses the user's real name/email, but fake identity data
+    return {
+        "contact": {
+            "email_address": email,
+            "phone_number": "555-555-5555",
+            "street_address": ["123 Simulation Blvd"],
+            "city": "New York",
+            "state": "NY",
+            "postal_code": "10001",
+            "country": "USA"
+        },
+        "identity": {
+            "given_name": first_name,
+            "family_name": last_name,
+            "date_of_birth": "1990-01-01",
+            "tax_id": "400-50-1234",
+            "tax_id_type": "USA_SSN",
+            "country_of_citizenship": "USA",
+            "country_of_birth": "USA",
+            "country_of_tax_residence": "USA",
+            "funding_source": ["employment_income"]
+        },
+        "disclosures": {
+            "is_control_person": False,
+            "is_affiliated_exchange_or_finra": False,
+            "is_politically_exposed": False,
+            "immediate_family_exposed": False
+        },
+        "agreements": [
+            {
+                "agreement": "margin_agreement",
+                "signed_at": datetime.utcnow().isoformat() + "Z",
+                "ip_address": "127.0.0.1"
+            },
+            {
+                "agreement": "account_agreement",
+                "signed_at": datetime.utcnow().isoformat() + "Z",
+                "ip_address": "127.0.0.1"
+            },
+            {
+                "agreement": "customer_agreement",
+                "signed_at": datetime.utcnow().isoformat() + "Z",
+                "ip_address": "127.0.0.1"
+            }
+        ]
+    }
 
-# initialize the database
-init_supabase_db()
+def find_alpaca_account(email):
+    response = alpaca.get("/accounts", params={'query': email})
+    if response.status_code != 200:
+        raise JobError(f"Account lookup failed: {response.status_code} {response.text}")
+    for account in response.json():
+        if (account.get('contact') or {}).get('email_address', '').lower() == email.lower():
+            return account.get('id')
+    return None
 
+@job_handler('create_alpaca_account')
+def create_alpaca_account_job(payload):
+    user_id = payload['user_id']
+    with get_supabase_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT alpaca_account_id FROM users WHERE user_id = %s", (user_id,))
+        row = cursor.fetchone()
+    if row is None:
+        raise JobError(f"User {user_id} no longer exists")
+    if row[0]:
+        # an earlier attempt already created it
+        return
+
+    # an earlier attempt that timed out or got a 5xx may still have created the account,
+    # posting again would make a second one for the same email, so adopt it instead
+    alpaca_account_id = find_alpaca_account(payload['email'])
+    if alpaca_account_id:
+        print(f"Alpaca Account Found: {alpaca_account_id}")
+    else:
+        response = alpaca.post("/accounts", json=build_alpaca_account_payload(payload['email'], payload['first_name'], payload['last_name']))
+        if response.status_code not in [200, 201]:
+            raise JobError(f"Trading Account Creation Failed: {response.text}")
+
+        alpaca_account_id = response.json().get('id')
+        print(f"Alpaca Account Created: {alpaca_account_id}")
+
+    with get_supabase_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE users SET alpaca_account_id = %s WHERE user_id = %s", (alpaca_account_id, user_id))
+        # give the sandbox a moment to activate the account before funding it
+        enqueue_job(cursor, 'fund_alpaca_account', {'alpaca_account_id': alpaca_account_id}, user_id=user_id, delay=1)
+
+    invalidate_user(user_id)
+    notify_job_workers()
+
+@job_handler('fund_alpaca_account')
+def fund_alpaca_account_job(payload):
+    if not fund_new_account(payload['alpaca_account_id']):
+        raise JobError(f"Funding failed for {payload['alpaca_account_id']}")
 
 def signup_user(email, password, first_name, last_name, terms):
     conn = get_supabase_connection()
     cursor = conn.cursor()
     
-    cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-    user = cursor.fetchone()
-    
-    if user:
-        conn.close()
-        return 'Email is already in use!'
-
-    alpaca_account_id = None
     try:
-        # uses the user's real name/email, but fake identity data
-        payload = {
-            "contact": {
-                "email_address": email,
-                "phone_number": "555-555-5555",
-                "street_address": ["123 Simulation Blvd"],
-                "city": "New York",
-                "state": "NY",
-                "postal_code": "10001",
-                "country": "USA"
-            },
-            "identity": {
-                "given_name": first_name,
-                "family_name": last_name,
-                "date_of_birth": "1990-01-01",
-                "tax_id": "400-50-1234",
-                "tax_id_type": "USA_SSN",
-                "country_of_citizenship": "USA",
-                "country_of_birth": "USA",
-                "country_of_tax_residence": "USA",
-                "funding_source": ["employment_income"]
-            },
-            "disclosures": {
-                "is_control_person": False,
-                "is_affiliated_exchange_or_finra": False,
-                "is_politically_exposed": False,
-                "immediate_family_exposed": False
-            },
-            "agreements": [
-                {
-                    "agreement": "margin_agreement",
-                    "signed_at": datetime.utcnow().isoformat() + "Z",
-                    "ip_address": "127.0.0.1"
-                },
-                {
-                    "agreement": "account_agreement",
-                    "signed_at": datetime.utcnow().isoformat() + "Z",
-                    "ip_address": "127.0.0.1"
-                },
-                {
-                    "agreement": "customer_agreement",
-                    "signed_at": datetime.utcnow().isoformat() + "Z",
-                    "ip_address": "127.0.0.1"
-                }
-            ]
-        }
-        
-        # Make the request to Alpaca
-        response = requests.post(
-            f"{ALPACA_BROKER_URL}/accounts",
-            json=payload,
-            headers=get_alpaca_headers()
-        )
-        
-        if response.status_code in [200, 201]:
-            alpaca_data = response.json()
-            alpaca_account_id = alpaca_data.get('id')
-            print(f"Alpaca Account Created: {alpaca_account_id}")
-            
-            # FUND THE ACCOUNT
-            fund_new_account(alpaca_account_id)
-            
-        else:
-            print(f"Alpaca Signup Failed: {response.text}")
-            conn.close()
-            return f'Trading Account Creation Failed: {response.text}'
-
-    except Exception as e:
-        print(f"Alpaca Error: {e}")
+        cursor.execute("SELECT 1 FROM users WHERE email = %s", (email,))
+        existing = cursor.fetchone()
+    except Exception:
         conn.close()
-        return 'Error creating trading account.'
+        raise
     
+    if existing:
+        conn.close()
+        return 'Email is already in use!', None
+
     # generate unique user_id
     user_id = str(uuid.uuid4())
     
@@ -317,7 +1555,7 @@ def signup_user(email, password, first_name, last_name, terms):
         cursor.execute("""
             INSERT INTO users (user_id, email, first_name, last_name, password_hash, terms, created_at, alpaca_account_id)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (user_id, email, first_name, last_name, hashed_password, terms, current_timestamp, alpaca_account_id))
+        """, (user_id, email, first_name, last_name, hashed_password, terms, current_timestamp, None))
         
         # Create My Watchlist for the new user
         watchlist_id = str(uuid.uuid4())
@@ -325,28 +1563,53 @@ def signup_user(email, password, first_name, last_name, terms):
             INSERT INTO watchlist (watchlist_id, user_id, watchlist_name, created_at, updated_at, position)
             VALUES (%s, %s, %s, %s, %s, %s)
         """, (watchlist_id, user_id, "My Watchlist", current_timestamp, current_timestamp, 0))
+
+        # the trading account is created and funded in the background
+        enqueue_job(cursor, 'create_alpaca_account', {
+            'user_id': user_id,
+            'email': email,
+            'first_name': first_name,
+            'last_name': last_name
+        }, user_id=user_id)
         
         conn.commit()
     except Exception as e:
         conn.rollback()
         print(f"DB Error: {e}")
-        return 'Database Error during signup.'
+        return 'Database Error during signup.', None
     finally:
         conn.close()
-    
-    return 'Signup successful! Please log in.'
+
+    # build the User from what was just inserted so auto-login needs no extra query,
+    # it has no trading account yet so it only stays cached for USER_PENDING_CACHE_TTL
+    user = User(user_id, email, first_name, last_name, None)
+    cache_user(user)
+
+    notify_job_workers()
+    return 'Signup successful! Please log in.', user
 
 def authenticate_user(email, password):
-    # Checks if account exists
-    conn = get_supabase_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-    user = cursor.fetchone()
-    conn.close()
+    # Checks if account exists, fetching everything the User needs in the same query
+    with get_supabase_connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT user_id, email, first_name, last_name, alpaca_account_id, password_hash
+            FROM users WHERE email = %s
+        """, (email,))
+        user_data = cursor.fetchone()
     # checks against database
-    if user:
-        salted_password = password + user[0]
-        if check_password_hash(user[4], salted_password):
+    if user_data:
+        salted_password = password + user_data['user_id']
+        if check_password_hash(user_data['password_hash'], salted_password):
+            user = User(
+                user_data['user_id'],
+                user_data['email'],
+                user_data['first_name'],
+                user_data['last_name'],
+                user_data['alpaca_account_id']
+            )
+            # login_user and the next requests read it from here
+            cache_user(user)
             return user
     return None
 
@@ -372,14 +1635,12 @@ def signup():
 
         terms = True  
 
-        message = signup_user(email, password, first_name, last_name, terms)
+        message, user = signup_user(email, password, first_name, last_name, terms)
         flash(message)
 
         if 'Signup successful!' in message:
             # Create a browser session for the new user
-            user_data_row = authenticate_user(email, password)
-            if user_data_row:
-                user = load_user(user_data_row[0]) # Use load_user to get the User object
+            if user:
                 login_user(user)
                 session.permanent = False  # Session lasts until browser closes
                 session['user_id'] = user.id
@@ -406,9 +1667,8 @@ def login():
             flash("Email and password are required", "error")
             return redirect(url_for('login'))
         # Validates if user exists or not
-        user_data_row = authenticate_user(email, password)
-        if user_data_row:
-            user = load_user(user_data_row[0]) # Use load_user
+        user = authenticate_user(email, password)
+        if user:
             login_user(user)
             # Checks if remember me is checked and if it is it creates a session
             remember = 'remember' in request.form
@@ -426,6 +1686,7 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
+    invalidate_user(current_user.id)
     logout_user()
     flash('You have been logged out.', 'success')
     return redirect(url_for('login'))
@@ -439,7 +1700,7 @@ def logout():
 def dashboard():
     list_type = request.args.get('list', 'my-watchlist')
     logo_api_key = os.getenv("LOGO_API_KEY", "")
-    return render_template('dashboard.html', user_id=current_user.id, list_type=list_type, logo_api_key=logo_api_key, stocks=STOCKS_DATA)
+    return render_template('dashboard.html', user_id=current_user.id, list_type=list_type, logo_api_key=logo_api_key, stocks=symbol_registry.stocks)
 
 @app.route('/homepage')
 def homepage():
@@ -452,18 +1713,127 @@ def terms():
 @app.route('/api/stocks')
 @cross_origin()
 def get_stocks():
+    symbol_registry.refresh()
+    sector = request.args.get('sector')
+
+    if sector:
+        body = symbol_registry.sector_json.get(sector, b'[]')
+        etag = f"{symbol_registry.etag}-{hashlib.sha1(sector.encode()).hexdigest()[:8]}"
+    else:
+        body = symbol_registry.json_bytes
+        etag = symbol_registry.etag
+
+    if etag is None:
+        return jsonify({"error": "Failed to load stock data"}), 500
+
+    # bytes are serialized once per file change, unchanged clients get a 304
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/search')
+@cross_origin()
+def search_stocks():
+    query = request.args.get('q', '').strip()
     try:
-        # Construct path to stocks.json
-        json_path = os.path.join(app.root_path, 'stocks.json')
-        
-        # Open and read the JSON file
-        with open(json_path, 'r') as f:
-            data = json.load(f)
-            
-        return jsonify(data)
+        limit = min(max(int(request.args.get('limit', SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    return jsonify({'query': query, 'results': symbol_search.search(query, limit)})
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+LOOPBACK_ADDRS = ('127.0.0.1', '::1')
+
+@metrics.collector
+def collect_cache_metrics():
+    samples = []
+    for key, value in db_pool.stats().items():
+        samples.append((f"penguin_db_pool_{key}", (), value))
+    for name, cache in (('users', user_cache), ('accounts', account_cache), ('quotes', quote_cache)):
+        for key, value in cache.stats().items():
+            samples.append((f"penguin_cache_{key}", (('cache', name),), value))
+    for key, value in feed_hub.stats().items():
+        samples.append((f"penguin_stream_{key}", (), value))
+    for key, value in last_known_good.stats().items():
+        samples.append((f"penguin_stale_cache_{key}", (), value))
+    for client in (alpaca, alpaca_data, history_client):
+        if client is not None:
+            for key, value in client.breaker.stats().items():
+                samples.append((f"penguin_circuit_{key}", (('upstream', client.name),), value))
+            if client.scheduler is not None:
+                for key, value in client.scheduler.stats().items():
+                    samples.append((f"penguin_upstream_queue_{key}", (('upstream', client.name),), value))
+    return samples
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+            return jsonify({'error': 'Unauthorized'}), 401
+    # without a token only a scraper on this machine gets in. a request relayed by a local
+    # proxy carries X-Forwarded-For, and on serverless hosts every request is relayed
+    elif SERVERLESS or request.remote_addr not in LOOPBACK_ADDRS or request.headers.get('X-Forwarded-For'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/jobs', methods=['GET'])
+@login_required
+def get_jobs():
+    # with no worker threads the client's progress poll is what moves its own jobs along
+    if JOB_RUN_ON_POLL and not job_workers:
+        try:
+            run_due_jobs(user_id=current_user.id, max_jobs=2)
+        except Exception as e:
+            print(f"Job Poll Error: {e}")
+    conn = get_supabase_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute("""
+            SELECT job_id, job_type, status, attempts, max_attempts, last_error, run_after, created_at, updated_at
+            FROM jobs
+            WHERE user_id = %s
+            ORDER BY created_at ASC
+        """, (current_user.id,))
+        jobs = cursor.fetchall()
+        # read from the row, the cached User can lag behind a job finished in another process
+        cursor.execute("SELECT alpaca_account_id FROM users WHERE user_id = %s", (current_user.id,))
+        row = cursor.fetchone()
+        ready = bool(row and row['alpaca_account_id'])
+        if ready and not current_user.alpaca_account_id:
+            invalidate_user(current_user.id)
+        return jsonify({
+            'success': True,
+            'trading_account_ready': ready,
+            'jobs': jobs
+        })
     except Exception as e:
-        print(f"Error loading stocks.json: {e}")
-        return jsonify({"error": "Failed to load stock data"}), 500
+        print(f"Error fetching jobs: {e}")
+        return jsonify({'error': 'Failed to fetch jobs'}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    conn = get_supabase_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute("""
+            SELECT job_id, job_type, status, attempts, max_attempts, last_error, run_after, created_at, updated_at
+            FROM jobs
+            WHERE job_id = %s AND user_id = %s
+        """, (job_id, current_user.id))
+        job = cursor.fetchone()
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job)
+    except Exception as e:
+        print(f"Error fetching job {job_id}: {e}")
+        return jsonify({'error': 'Failed to fetch job'}), 500
+    finally:
+        conn.close()
 
 @app.route('/api/create_watchlist', methods=['POST'])
 @login_required
@@ -494,6 +1864,7 @@ def create_watchlist():
             INSERT INTO watchlist (watchlist_id, user_id, watchlist_name, created_at, updated_at, position)
             VALUES (%s, %s, %s, %s, %s, %s)
         """, (watchlist_id, user_id, watchlist_name, current_timestamp, current_timestamp, next_position))
+        bump_watchlist_version(cursor, user_id)
         
         conn.commit()
         
@@ -518,34 +1889,46 @@ def get_watchlists():
     cursor = conn.cursor(cursor_factory=RealDictCursor)
 
     try:
-        # Fetch watchlists
+        # cheap version check first so unchanged watchlists cost one tiny query
+        if request.if_none_match:
+            cursor.execute("SELECT watchlist_version FROM users WHERE user_id = %s", (user_id,))
+            row = cursor.fetchone()
+            if row and request.if_none_match.contains_weak(watchlist_etag(user_id, row['watchlist_version'])):
+                response = make_response('', 304)
+                response.set_etag(watchlist_etag(user_id, row['watchlist_version']))
+                response.headers['Cache-Control'] = 'private, no-cache'
+                return response
+
+        # Fetch watchlists together with their items in one round trip
         cursor.execute("""
-            SELECT watchlist_id, watchlist_name, created_at 
-            FROM watchlist 
-            WHERE user_id = %s 
-            ORDER BY position ASC, created_at ASC
-        """, (user_id,))
+            SELECT w.watchlist_id, w.watchlist_name, w.created_at,
+                   COALESCE(
+                       array_agg(i.stock_symbol ORDER BY i.position ASC, i.added_at ASC)
+                           FILTER (WHERE i.stock_symbol IS NOT NULL),
+                       '{}'
+                   ) AS items,
+                   (SELECT watchlist_version FROM users WHERE user_id = %s) AS version
+            FROM watchlist w
+            LEFT JOIN watchlist_items i ON i.watchlist_id = w.watchlist_id
+            WHERE w.user_id = %s
+            GROUP BY w.watchlist_id, w.watchlist_name, w.created_at, w.position
+            ORDER BY w.position ASC, w.created_at ASC
+        """, (user_id, user_id))
         watchlists = cursor.fetchall()
-        
-        # For each watchlist, fetch items
-        result = []
-        for wl in watchlists:
-            cursor.execute("""
-                SELECT stock_symbol 
-                FROM watchlist_items 
-                WHERE watchlist_id = %s
-                ORDER BY position ASC, added_at ASC
-            """, (wl['watchlist_id'],))
-            items = [row['stock_symbol'] for row in cursor.fetchall()]
-            
-            result.append({
-                'id': wl['watchlist_id'],
-                'name': wl['watchlist_name'],
-                'created_at': wl['created_at'],
-                'items': items
-            })
-            
-        return jsonify({'success': True, 'watchlists': result})
+
+        result = [{
+            'id': wl['watchlist_id'],
+            'name': wl['watchlist_name'],
+            'created_at': wl['created_at'],
+            'items': wl['items']
+        } for wl in watchlists]
+
+        response = jsonify({'success': True, 'watchlists': result})
+        if watchlists:
+            response.set_etag(watchlist_etag(user_id, watchlists[0]['version']))
+            # the browser revalidates with If-None-Match on every fetch
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     except Exception as e:
         print(f"Error fetching watchlists: {e}")
         return jsonify({'error': 'Failed to fetch watchlists'}), 500
@@ -577,9 +1960,10 @@ def manage_watchlist(watchlist_id):
             db_symbols = [r[1] for r in rows if r[1]]
             
             # Enrich with local JSON data
+            symbol_registry.refresh()
             enriched_items = []
             for sym in db_symbols:
-                stock_info = next((s for s in STOCKS_DATA if s['symbol'] == sym), None)
+                stock_info = symbol_registry.get(sym)
                 if stock_info:
                     enriched_items.append({
                         'symbol': sym,
@@ -588,6 +1972,18 @@ def manage_watchlist(watchlist_id):
                     })
                 else:
                     enriched_items.append({'symbol': sym}) # Fallback
+
+            # ?quotes=1 embeds the latest prices so the page needs no per-symbol calls
+            if request.args.get('quotes') and db_symbols:
+                conn.close()
+                try:
+                    quotes = quote_cache.get_many([s.upper() for s in db_symbols])
+                    for item in enriched_items:
+                        quote = quotes.get(item['symbol'].upper())
+                        if quote:
+                            item.update({k: quote[k] for k in ('price', 'change', 'changePercent', 'isPositive')})
+                except Exception as e:
+                    print(f"Watchlist Quotes Error: {e}")
             
             return jsonify({
                 'id': watchlist_id,
@@ -602,12 +1998,14 @@ def manage_watchlist(watchlist_id):
                 return jsonify({'error': 'Name is required'}), 400
                 
             cursor.execute("UPDATE watchlist SET watchlist_name = %s WHERE watchlist_id = %s AND user_id = %s", (new_name, watchlist_id, current_user.id))
+            bump_watchlist_version(cursor, current_user.id)
             conn.commit()
             return jsonify({'success': True})
 
         elif request.method == 'DELETE':
             cursor.execute("DELETE FROM watchlist_items WHERE watchlist_id = %s", (watchlist_id,))
             cursor.execute("DELETE FROM watchlist WHERE watchlist_id = %s AND user_id = %s", (watchlist_id, current_user.id))
+            bump_watchlist_version(cursor, current_user.id)
             conn.commit()
             return jsonify({'success': True})
 
@@ -627,6 +2025,9 @@ def reorder_watchlist_items():
     
     if not watchlist_id or not ordered_items or not isinstance(ordered_items, list):
         return jsonify({'error': 'Invalid data'}), 400
+    if not all(isinstance(symbol, str) for symbol in ordered_items):
+        return jsonify({'error': 'Invalid data'}), 400
+    ordered_items = [symbol.strip().upper() for symbol in ordered_items]
 
     conn = get_supabase_connection()
     cursor = conn.cursor()
@@ -638,16 +2039,21 @@ def reorder_watchlist_items():
         if not result or result[0] != current_user.id:
              return jsonify({'error': 'Watchlist not found or unauthorized'}), 404
              
-        # Update positions
-        for index, symbol in enumerate(ordered_items):
-            cursor.execute("""
-                UPDATE watchlist_items 
-                SET position = %s 
-                WHERE watchlist_id = %s AND stock_symbol = %s
-            """, (index, watchlist_id, symbol))
+        # Update every position in one statement, rows already in place are left alone
+        cursor.execute("""
+            UPDATE watchlist_items i
+            SET position = v.position - 1
+            FROM unnest(%s::text[]) WITH ORDINALITY AS v(stock_symbol, position)
+            WHERE i.watchlist_id = %s
+              AND i.stock_symbol = v.stock_symbol
+              AND i.position IS DISTINCT FROM v.position - 1
+        """, (list(dict.fromkeys(ordered_items)), watchlist_id))
+        updated = cursor.rowcount
+        if updated:
+            bump_watchlist_version(cursor, current_user.id)
             
         conn.commit()
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'updated': updated})
     except Exception as e:
         conn.rollback()
         print(f"Error reordering items: {e}")
@@ -663,21 +2069,28 @@ def reorder_watchlists():
     
     if not ordered_ids or not isinstance(ordered_ids, list):
         return jsonify({'error': 'Invalid data format'}), 400
+    if not all(isinstance(watchlist_id, str) for watchlist_id in ordered_ids):
+        return jsonify({'error': 'Invalid data format'}), 400
 
     conn = get_supabase_connection()
     cursor = conn.cursor()
     
     try:
-        # Update positions
-        for index, watchlist_id in enumerate(ordered_ids):
-            cursor.execute("""
-                UPDATE watchlist 
-                SET position = %s 
-                WHERE watchlist_id = %s AND user_id = %s
-            """, (index, watchlist_id, current_user.id))
+        # Update every position in one statement, the user_id filter keeps it to the user's own lists
+        cursor.execute("""
+            UPDATE watchlist w
+            SET position = v.position - 1
+            FROM unnest(%s::text[]) WITH ORDINALITY AS v(watchlist_id, position)
+            WHERE w.watchlist_id = v.watchlist_id
+              AND w.user_id = %s
+              AND w.position IS DISTINCT FROM v.position - 1
+        """, (list(dict.fromkeys(ordered_ids)), current_user.id))
+        updated = cursor.rowcount
+        if updated:
+            bump_watchlist_version(cursor, current_user.id)
             
         conn.commit()
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'updated': updated})
     except Exception as e:
         conn.rollback()
         print(f"Error reordering watchlists: {e}")
@@ -691,6 +2104,8 @@ def manage_watchlist_item():
     data = request.get_json()
     watchlist_id = data.get('watchlist_id')
     symbol = data.get('symbol')
+    # stored upper case, the same as the bulk endpoint, so 'aapl' and 'AAPL' are one item
+    symbol = symbol.strip().upper() if isinstance(symbol, str) else None
     
     if not watchlist_id or not symbol:
         return jsonify({'error': 'Watchlist ID and symbol are required'}), 400
@@ -699,45 +2114,50 @@ def manage_watchlist_item():
     cursor = conn.cursor()
     
     try:
-        # Verify ownership
-        cursor.execute("SELECT user_id FROM watchlist WHERE watchlist_id = %s", (watchlist_id,))
-        result = cursor.fetchone()
-        if not result or result[0] != current_user.id:
-             return jsonify({'error': 'Watchlist not found or unauthorized'}), 404
-
         if request.method == 'POST':
-            # Check if item exists
-            cursor.execute("""
-                SELECT 1 FROM watchlist_items 
-                WHERE watchlist_id = %s AND stock_symbol = %s
-            """, (watchlist_id, symbol))
-            
-            if cursor.fetchone():
-                return jsonify({'success': True, 'message': 'Item already in watchlist'})
-            
-            # Get next position
-            cursor.execute("""
-                SELECT COALESCE(MAX(position), -1) + 1 
-                FROM watchlist_items 
-                WHERE watchlist_id = %s
-            """, (watchlist_id,))
-            next_position = cursor.fetchone()[0]
-
-            # Add item
+            # Ownership check, next position, insert and version bump in one round trip
             item_id = str(uuid.uuid4())
             cursor.execute("""
-                INSERT INTO watchlist_items (watchlist_item_id, watchlist_id, stock_symbol, added_at, position)
-                VALUES (%s, %s, %s, NOW(), %s)
-            """, (item_id, watchlist_id, symbol, next_position))
+                WITH owner AS (
+                    SELECT watchlist_id FROM watchlist
+                    WHERE watchlist_id = %s AND user_id = %s
+                ),
+                added AS (
+                    INSERT INTO watchlist_items (watchlist_item_id, watchlist_id, stock_symbol, added_at, position)
+                    SELECT %s, o.watchlist_id, %s, NOW(),
+                           COALESCE((SELECT MAX(position) FROM watchlist_items WHERE watchlist_id = o.watchlist_id), -1) + 1
+                    FROM owner o
+                    ON CONFLICT DO NOTHING
+                    RETURNING stock_symbol
+                ),
+                bumped AS (
+                    UPDATE users SET watchlist_version = watchlist_version + 1
+                    WHERE user_id = %s AND EXISTS (SELECT 1 FROM added)
+                )
+                SELECT EXISTS (SELECT 1 FROM owner), EXISTS (SELECT 1 FROM added)
+            """, (watchlist_id, current_user.id, item_id, symbol, current_user.id))
+            owned, added = cursor.fetchone()
             conn.commit()
+
+            if not owned:
+                return jsonify({'error': 'Watchlist not found or unauthorized'}), 404
+            if not added:
+                return jsonify({'success': True, 'message': 'Item already in watchlist'})
             return jsonify({'success': True, 'message': 'Item added'})
             
         elif request.method == 'DELETE':
+            # Verify ownership
+            cursor.execute("SELECT user_id FROM watchlist WHERE watchlist_id = %s", (watchlist_id,))
+            result = cursor.fetchone()
+            if not result or result[0] != current_user.id:
+                 return jsonify({'error': 'Watchlist not found or unauthorized'}), 404
+
             # Remove item
             cursor.execute("""
                 DELETE FROM watchlist_items 
                 WHERE watchlist_id = %s AND stock_symbol = %s
             """, (watchlist_id, symbol))
+            bump_watchlist_version(cursor, current_user.id)
             conn.commit()
             return jsonify({'success': True, 'message': 'Item removed'})
             
@@ -748,6 +2168,86 @@ def manage_watchlist_item():
     finally:
         conn.close()
 
+WATCHLIST_BULK_LIMIT = int(os.getenv('WATCHLIST_BULK_LIMIT', '500'))
+
+def normalize_symbols(symbols):
+    # uppercase, strip blanks and drop duplicates while keeping the pasted order
+    return list(dict.fromkeys(s.strip().upper() for s in symbols if isinstance(s, str) and s.strip()))
+
+@app.route('/api/watchlist/items', methods=['POST'])
+@login_required
+def bulk_watchlist_items():
+    data = request.get_json() or {}
+    watchlist_id = data.get('watchlist_id')
+    add = data.get('add') or []
+    remove = data.get('remove') or []
+
+    if not watchlist_id or not isinstance(add, list) or not isinstance(remove, list):
+        return jsonify({'error': 'Watchlist ID and lists of symbols are required'}), 400
+
+    add = normalize_symbols(add)
+    remove = normalize_symbols(remove)
+    if not add and not remove:
+        return jsonify({'error': 'No symbols given'}), 400
+    if len(add) + len(remove) > WATCHLIST_BULK_LIMIT:
+        return jsonify({'error': f'At most {WATCHLIST_BULK_LIMIT} symbols per request'}), 400
+    if set(add) & set(remove):
+        return jsonify({'error': 'A symbol cannot be added and removed in the same request'}), 400
+
+    conn = get_supabase_connection()
+    cursor = conn.cursor()
+
+    try:
+        item_ids = [str(uuid.uuid4()) for _ in add]
+        cursor.execute("""
+            WITH owner AS (
+                SELECT watchlist_id FROM watchlist
+                WHERE watchlist_id = %s AND user_id = %s
+            ),
+            removed AS (
+                DELETE FROM watchlist_items i
+                USING owner o
+                WHERE i.watchlist_id = o.watchlist_id AND i.stock_symbol = ANY(%s::text[])
+                RETURNING i.stock_symbol
+            ),
+            added AS (
+                INSERT INTO watchlist_items (watchlist_item_id, watchlist_id, stock_symbol, added_at, position)
+                SELECT v.item_id, o.watchlist_id, v.symbol, NOW(),
+                       COALESCE((SELECT MAX(position) FROM watchlist_items WHERE watchlist_id = o.watchlist_id), -1) + v.ord
+                FROM owner o
+                CROSS JOIN unnest(%s::text[], %s::text[]) WITH ORDINALITY AS v(item_id, symbol, ord)
+                ON CONFLICT DO NOTHING
+                RETURNING stock_symbol
+            ),
+            bumped AS (
+                UPDATE users SET watchlist_version = watchlist_version + 1
+                WHERE user_id = %s AND (EXISTS (SELECT 1 FROM added) OR EXISTS (SELECT 1 FROM removed))
+            )
+            SELECT EXISTS (SELECT 1 FROM owner),
+                   ARRAY(SELECT stock_symbol FROM added),
+                   ARRAY(SELECT stock_symbol FROM removed)
+        """, (watchlist_id, current_user.id, remove, item_ids, add, current_user.id))
+        owned, added, removed = cursor.fetchone()
+        conn.commit()
+
+        if not owned:
+            return jsonify({'error': 'Watchlist not found or unauthorized'}), 404
+
+        # symbols already present (add) or not in the list (remove) are reported as skipped
+        done = set(added) | set(removed)
+        return jsonify({
+            'success': True,
+            'added': added,
+            'removed': removed,
+            'skipped': [s for s in add + remove if s not in done]
+        })
+    except Exception as e:
+        conn.rollback()
+        print(f"Error bulk updating watchlist {watchlist_id}: {e}")
+        return jsonify({'error': 'Database error'}), 500
+    finally:
+        conn.close()
+
 
 # alpaca trading proxy routes
 
@@ -757,15 +2257,15 @@ def get_portfolio():
     if not current_user.alpaca_account_id:
         return jsonify({'error': 'No trading account found'}), 400
         
+    alpaca_id = current_user.alpaca_account_id
     try:
-        response = requests.get(
-            f"{ALPACA_BROKER_URL}/trading/accounts/{current_user.alpaca_account_id}/account",
-            headers=get_alpaca_headers()
-        )
+        response, stale_age = last_known_good.fetch(('account', alpaca_id), lambda: fetch_trading_account(alpaca_id))
         if response.status_code == 200:
-            return jsonify(response.json())
+            return mark_stale(jsonify(response.json()), stale_age)
         else:
             return jsonify({'error': 'Failed to fetch portfolio', 'details': response.text}), response.status_code
+    except (CircuitOpenError, RateLimitTimeout) as e:
+        return upstream_unavailable(e)
     except Exception as e:
         print(f"Portfolio Error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -776,26 +2276,30 @@ def get_positions():
     if not current_user.alpaca_account_id:
         return jsonify({'error': 'No trading account found'}), 400
         
+    alpaca_id = current_user.alpaca_account_id
     try:
-        response = requests.get(
-            f"{ALPACA_BROKER_URL}/trading/accounts/{current_user.alpaca_account_id}/positions",
-            headers=get_alpaca_headers()
-        )
+        response, stale_age = last_known_good.fetch(('positions', alpaca_id), lambda: alpaca.get(f"/trading/accounts/{alpaca_id}/positions"))
         if response.status_code == 200:
-            return jsonify(response.json())
+            return mark_stale(jsonify(response.json()), stale_age)
         else:
             return jsonify({'error': 'Failed to fetch positions', 'details': response.text}), response.status_code
+    except (CircuitOpenError, RateLimitTimeout) as e:
+        return upstream_unavailable(e)
     except Exception as e:
         print(f"Positions Error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
-@app.route('/api/order', methods=['POST'])
-@login_required
-def place_order():
-    if not current_user.alpaca_account_id:
-        return jsonify({'error': 'No trading account found'}), 400
-        
-    data = request.get_json()
+ORDER_BATCH_LIMIT = int(os.getenv('ORDER_BATCH_LIMIT', '50'))
+ORDER_BATCH_WORKERS = int(os.getenv('ORDER_BATCH_WORKERS', '8'))
+
+# shared so concurrent batches can't open more than ORDER_BATCH_WORKERS upstream calls in total
+order_executor = ThreadPoolExecutor(max_workers=ORDER_BATCH_WORKERS, thread_name_prefix='order')
+
+# returns (payload, error) for one order from the request body
+def build_order_payload(data):
+    if not isinstance(data, dict):
+        return None, 'Order must be an object'
+
     symbol = data.get('symbol')
     qty = data.get('qty')
     side = data.get('side') # buy or sell
@@ -803,34 +2307,697 @@ def place_order():
     time_in_force = data.get('time_in_force', 'day')
     
     if not all([symbol, qty, side]):
-        return jsonify({'error': 'Missing order parameters'}), 400
-        
+        return None, 'Missing order parameters'
+    if side not in ('buy', 'sell'):
+        return None, 'Side must be buy or sell'
     try:
-        payload = {
-            "symbol": symbol,
-            "qty": qty,
-            "side": side,
-            "type": type,
-            "time_in_force": time_in_force
-        }
+        if float(qty) <= 0:
+            return None, 'Quantity must be positive'
+    except (TypeError, ValueError):
+        return None, 'Quantity must be a number'
+
+    payload = {
+        "symbol": symbol,
+        "qty": qty,
+        "side": side,
+        "type": type,
+        "time_in_force": time_in_force
+    }
+    for field in ('limit_price', 'stop_price', 'client_order_id'):
+        if data.get(field) is not None:
+            payload[field] = data[field]
+    return payload, None
+
+def submit_order(alpaca_id, payload):
+    return alpaca.post(f"/trading/accounts/{alpaca_id}/orders", json=payload)
+
+def order_error_details(response):
+    try:
+        return response.json() if response.content else {'message': response.text}
+    except ValueError:
+        return {'message': response.text}
+
+@app.route('/api/order', methods=['POST'])
+@login_required
+def place_order():
+    if not current_user.alpaca_account_id:
+        return jsonify({'error': 'No trading account found'}), 400
         
-        response = requests.post(
-            f"{ALPACA_BROKER_URL}/trading/accounts/{current_user.alpaca_account_id}/orders",
-            json=payload,
-            headers=get_alpaca_headers()
-        )
+    payload, error = build_order_payload(request.get_json())
+    if error:
+        return jsonify({'error': error}), 400
+        
+    try:
+        response = submit_order(current_user.alpaca_account_id, payload)
         
         if response.status_code in [200, 201]:
+            # cash and buying power changed, drop the cached account
+            account_cache.invalidate(current_user.alpaca_account_id)
+            feed_hub.nudge(current_user.alpaca_account_id)
             return jsonify(response.json())
         else:
             # Pass the error from Alpaca back to frontend
-            error_data = response.json() if response.content else {'message': response.text}
-            return jsonify({'error': 'Order failed', 'details': error_data}), response.status_code
+            return jsonify({'error': 'Order failed', 'details': order_error_details(response)}), response.status_code
             
+    except (CircuitOpenError, RateLimitTimeout) as e:
+        # never sent, so the client can safely retry
+        return upstream_unavailable(e)
     except Exception as e:
         print(f"Order Error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/orders/batch', methods=['POST'])
+@login_required
+def place_orders_batch():
+    alpaca_id = current_user.alpaca_account_id
+    if not alpaca_id:
+        return jsonify({'error': 'No trading account found'}), 400
+
+    data = request.get_json() or {}
+    orders = data.get('orders') if isinstance(data, dict) else data
+    if not isinstance(orders, list) or not orders:
+        return jsonify({'error': 'A list of orders is required'}), 400
+    if len(orders) > ORDER_BATCH_LIMIT:
+        return jsonify({'error': f'At most {ORDER_BATCH_LIMIT} orders per batch'}), 400
+
+    # validate everything before sending anything upstream
+    results = [None] * len(orders)
+    pending = {}
+    for index, order in enumerate(orders):
+        payload, error = build_order_payload(order)
+        if error:
+            results[index] = {'index': index, 'status': 'invalid', 'error': error}
+        else:
+            pending[index] = payload
+
+    # unsent: never left this server, safe to retry after retry_after seconds
+    # unknown: may have reached alpaca, check the account's orders before retrying
+    futures = {order_executor.submit(submit_order, alpaca_id, payload): index for index, payload in pending.items()}
+    for future in as_completed(futures):
+        index = futures[future]
+        try:
+            response = future.result()
+        except (CircuitOpenError, RateLimitTimeout) as e:
+            results[index] = {'index': index, 'status': 'unsent', 'error': 'Upstream unavailable', 'retry_after': max(1, int(e.retry_after + 0.5))}
+            continue
+        except requests.RequestException as e:
+            print(f"Batch Order Error: {e}")
+            results[index] = {'index': index, 'status': 'unknown', 'error': 'No response from broker'}
+            continue
+        except Exception as e:
+            print(f"Batch Order Error: {e}")
+            results[index] = {'index': index, 'status': 'unknown', 'error': 'Internal server error'}
+            continue
+
+        if response.status_code in [200, 201]:
+            results[index] = {'index': index, 'status': 'accepted', 'order': response.json()}
+        else:
+            results[index] = {
+                'index': index,
+                'status': 'unknown' if response.status_code >= 500 else 'rejected',
+                'error': 'Order failed',
+                'status_code': response.status_code,
+                'details': order_error_details(response)
+            }
+
+    counts = Counter(r['status'] for r in results)
+    accepted = counts['accepted']
+    if accepted:
+        account_cache.invalidate(alpaca_id)
+        feed_hub.nudge(alpaca_id)
+
+    return jsonify({
+        'success': accepted == len(orders),
+        'accepted': accepted,
+        'rejected': counts['rejected'] + counts['invalid'],
+        'unsent': counts['unsent'],
+        'unknown': counts['unknown'],
+        'results': results
+    })
+
+
+# quote snapshot settings
+QUOTE_CACHE_TTL = float(os.getenv('QUOTE_CACHE_TTL', '5'))
+QUOTE_BATCH_SIZE = int(os.getenv('QUOTE_BATCH_SIZE', '100'))
+QUOTE_MAX_SYMBOLS = int(os.getenv('QUOTE_MAX_SYMBOLS', '200'))
+QUOTE_FEED = os.getenv('QUOTE_FEED', 'iex')
+
+# shape matches what script.js renders for a stock (price, change, changePercent, isPositive)
+def quote_from_snapshot(symbol, snapshot):
+    latest_trade = snapshot.get('latestTrade') or {}
+    minute_bar = snapshot.get('minuteBar') or {}
+    daily_bar = snapshot.get('dailyBar') or {}
+    prev_bar = snapshot.get('prevDailyBar') or {}
+
+    price = latest_trade.get('p') or minute_bar.get('c') or daily_bar.get('c')
+    if price is None:
+        return None
+    prev_close = prev_bar.get('c')
+    change = price - prev_close if prev_close else 0.0
+    return {
+        'symbol': symbol,
+        'price': price,
+        'prevClose': prev_close,
+        'change': round(change, 4),
+        'changePercent': round(change / prev_close * 100, 4) if prev_close else 0.0,
+        'isPositive': change >= 0,
+        'timestamp': latest_trade.get('t') or minute_bar.get('t')
+    }
+
+# per-symbol quote cache, misses from every caller are fetched together in batched calls
+class QuoteCache:
+    def __init__(self, ttl=5, batch_size=100):
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self._entries = {}  # symbol -> (expires_at, quote)
+        self._inflight = {}  # symbol -> Event set when its fetch finishes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _fetch(self, symbols):
+        quotes = {}
+        for i in range(0, len(symbols), self.batch_size):
+            chunk = symbols[i:i + self.batch_size]
+            response = alpaca_data.get("/stocks/snapshots", params={'symbols': ','.join(chunk), 'feed': QUOTE_FEED})
+            if response.status_code != 200:
+                print(f"Quote Snapshot Error: {response.status_code} {response.text}")
+                continue
+            data = response.json()
+            # older responses nest the snapshots under "snapshots"
+            data = data.get('snapshots', data) if isinstance(data, dict) else {}
+            for symbol, snapshot in data.items():
+                quote = quote_from_snapshot(symbol, snapshot or {})
+                if quote:
+                    quotes[symbol] = quote
+        return quotes
+
+    def get_many(self, symbols, wait=5.0):
+        now = time.time()
+        result = {}
+        to_fetch = []
+        waiting = []
+        with self._lock:
+            for symbol in symbols:
+                entry = self._entries.get(symbol)
+                if entry and entry[0] > now:
+                    self.hits += 1
+                    result[symbol] = entry[1]
+                elif symbol in self._inflight:
+                    waiting.append((symbol, self._inflight[symbol]))
+                else:
+                    self.misses += 1
+                    self._inflight[symbol] = threading.Event()
+                    to_fetch.append(symbol)
+
+        if to_fetch:
+            quotes = {}
+            try:
+                quotes = self._fetch(to_fetch)
+            except Exception as e:
+                print(f"Quote Fetch Error: {e}")
+            finally:
+                expires = time.time() + self.ttl
+                with self._lock:
+                    for symbol in to_fetch:
+                        if symbol in quotes:
+                            self._entries[symbol] = (expires, quotes[symbol])
+                        self._inflight.pop(symbol).set()
+            result.update(quotes)
+
+        # symbols another request was already fetching
+        for symbol, done in waiting:
+            done.wait(wait)
+            with self._lock:
+                entry = self._entries.get(symbol)
+            if entry:
+                result[symbol] = entry[1]
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+quote_cache = QuoteCache(ttl=QUOTE_CACHE_TTL, batch_size=QUOTE_BATCH_SIZE)
+
+@app.route('/api/quotes', methods=['GET'])
+@login_required
+def get_quotes():
+    symbols = normalize_symbols(request.args.get('symbols', '').split(','))
+    if not symbols:
+        return jsonify({'error': 'At least one symbol is required'}), 400
+    if len(symbols) > QUOTE_MAX_SYMBOLS:
+        return jsonify({'error': f'At most {QUOTE_MAX_SYMBOLS} symbols per request'}), 400
+
+    try:
+        quotes = quote_cache.get_many(symbols)
+    except Exception as e:
+        print(f"Quotes Error: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+    return jsonify({
+        'quotes': quotes,
+        'missing': [s for s in symbols if s not in quotes]
+    })
+
+
+# live account stream settings
+STREAM_POLL_INTERVAL = float(os.getenv('STREAM_POLL_INTERVAL', '5'))
+STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', '15'))
+STREAM_IDLE_TIMEOUT = float(os.getenv('STREAM_IDLE_TIMEOUT', '30'))
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '100'))
+
+# polls alpaca for everything the dashboard shows, one call per topic
+class AlpacaEventSource:
+    def poll(self, alpaca_id):
+        snapshot = {}
+        # background polling gives way to everything a user is waiting on
+        response = fetch_trading_account(alpaca_id, priority=PRIORITY_LOW)
+        if response.status_code == 200:
+            snapshot['account'] = response.json()
+        response = alpaca.get(f"/trading/accounts/{alpaca_id}/positions", priority=PRIORITY_LOW)
+        if response.status_code == 200:
+            snapshot['positions'] = response.json()
+        response = alpaca.get(f"/trading/accounts/{alpaca_id}/orders", params={'status': 'all', 'limit': 50}, priority=PRIORITY_LOW)
+        if response.status_code == 200:
+            snapshot['orders'] = response.json()
+        return snapshot
+
+# one upstream poller per account, fanned out to every open tab
+class AccountFeed:
+    def __init__(self, hub, alpaca_id):
+        self.hub = hub
+        self.alpaca_id = alpaca_id
+        self.subscribers = set()
+        self.latest = {}  # topic -> (fingerprint, data)
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"feed-{alpaca_id}", daemon=True)
+        self.idle_since = None
+
+    def publish(self, topic, data):
+        fingerprint = json.dumps(data, sort_keys=True, default=str)
+        with self.hub.lock:
+            previous = self.latest.get(topic)
+            if previous and previous[0] == fingerprint:
+                return
+            self.latest[topic] = (fingerprint, data)
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait((topic, data))
+            except queue.Full:
+                # slow tab, it will catch up on the next change
+                pass
+
+    def run(self):
+        while True:
+            try:
+                for topic, data in self.hub.source.poll(self.alpaca_id).items():
+                    self.publish(topic, data)
+            except Exception as e:
+                print(f"Stream Poll Error {self.alpaca_id}: {e}")
+
+            self.wakeup.wait(self.hub.poll_interval)
+            self.wakeup.clear()
+
+            with self.hub.lock:
+                if self.subscribers:
+                    self.idle_since = None
+                elif self.idle_since is None:
+                    self.idle_since = time.time()
+                elif time.time() - self.idle_since >= self.hub.idle_timeout:
+                    del self.hub.feeds[self.alpaca_id]
+                    return
+
+class FeedHub:
+    def __init__(self, source, poll_interval=5, idle_timeout=30, queue_size=100):
+        self.source = source
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.queue_size = queue_size
+        self.feeds = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, alpaca_id):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            feed = self.feeds.get(alpaca_id)
+            start = feed is None
+            if start:
+                feed = self.feeds[alpaca_id] = AccountFeed(self, alpaca_id)
+            feed.subscribers.add(q)
+            # new tabs get the last known state straight away
+            for topic, (_, data) in feed.latest.items():
+                q.put_nowait((topic, data))
+        if start:
+            feed.thread.start()
+        return q
+
+    def unsubscribe(self, alpaca_id, q):
+        with self.lock:
+            feed = self.feeds.get(alpaca_id)
+            if feed:
+                feed.subscribers.discard(q)
+
+    # poll now instead of waiting for the next interval, e.g. after an order
+    def nudge(self, alpaca_id):
+        with self.lock:
+            feed = self.feeds.get(alpaca_id)
+        if feed:
+            feed.wakeup.set()
+
+    def stats(self):
+        with self.lock:
+            return {'feeds': len(self.feeds), 'subscribers': sum(len(f.subscribers) for f in self.feeds.values())}
+
+feed_hub = FeedHub(
+    AlpacaEventSource(),
+    poll_interval=STREAM_POLL_INTERVAL,
+    idle_timeout=STREAM_IDLE_TIMEOUT,
+    queue_size=STREAM_QUEUE_SIZE
+)
+
+def format_sse(topic, data):
+    return f"event: {topic}\ndata: {app.json.dumps(data)}\n\n"
+
+@app.route('/api/stream', methods=['GET'])
+@login_required
+def stream_account():
+    alpaca_id = current_user.alpaca_account_id
+    if not alpaca_id:
+        return jsonify({'error': 'No trading account found'}), 400
+
+    def events():
+        q = feed_hub.subscribe(alpaca_id)
+        try:
+            yield f"retry: {int(STREAM_HEARTBEAT * 1000)}\n\n"
+            while True:
+                try:
+                    topic, data = q.get(timeout=STREAM_HEARTBEAT)
+                except queue.Empty:
+                    # comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(topic, data)
+        finally:
+            feed_hub.unsubscribe(alpaca_id, q)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+# history bar cache settings
+HISTORY_CACHE_DIR = os.getenv('HISTORY_CACHE_DIR')
+HISTORY_CACHE_MAX_SERIES = int(os.getenv('HISTORY_CACHE_MAX_SERIES', '500'))
+HISTORY_MAX_STALENESS = float(os.getenv('HISTORY_MAX_STALENESS', '60'))
+HISTORY_SINCE_PARAM = os.getenv('HISTORY_SINCE_PARAM', 'start')
+HISTORY_PIXELS_PER_BAR = float(os.getenv('HISTORY_PIXELS_PER_BAR', '2'))
+HISTORY_DOWNSAMPLE_CACHE = int(os.getenv('HISTORY_DOWNSAMPLE_CACHE', '8'))
+# newest bars kept per series, older ones are dropped after every merge and on load
+HISTORY_MAX_BARS = int(os.getenv('HISTORY_MAX_BARS', '5000'))
+# bounds for max_points/width, so a huge value can't overflow or grow the downsample cache
+HISTORY_MIN_POINTS = 2
+HISTORY_MAX_POINTS = 10000
+HISTORY_CONNECT_TIMEOUT = float(os.getenv('HISTORY_CONNECT_TIMEOUT', '3.05'))
+HISTORY_READ_TIMEOUT = float(os.getenv('HISTORY_READ_TIMEOUT', '10'))
+HISTORY_MAX_RETRIES = int(os.getenv('HISTORY_MAX_RETRIES', '1'))
+HISTORY_URL = os.getenv('TAILSCALE_HISTORY_URL')
+
+# verify=False bypasses the Certificate Transparency check that browsers enforce
+history_client = UpstreamClient(
+    HISTORY_URL,
+    pool_size=ALPACA_POOL_SIZE,
+    connect_timeout=HISTORY_CONNECT_TIMEOUT,
+    read_timeout=HISTORY_READ_TIMEOUT,
+    max_retries=HISTORY_MAX_RETRIES,
+    backoff=ALPACA_RETRY_BACKOFF,
+    name='history',
+    verify=False,
+    **UPSTREAM_OPTIONS
+) if HISTORY_URL else None
+
+# seconds per bar, mirrors TIMEFRAMES in script.js
+TIMEFRAME_SECONDS = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '30m': 1800,
+    '1h': 3600,
+    '4h': 14400,
+    '1d': 86400,
+    '1w': 604800
+}
+
+BAR_FIELDS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+def parse_bar_time(value):
+    if isinstance(value, (int, float)):
+        ts = float(value)
+    else:
+        try:
+            ts = float(value)
+        except (TypeError, ValueError):
+            ts = datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    # some feeds send milliseconds
+    return ts / 1000 if ts > 1e12 else ts
+
+# the history backend returns either a list or {"bars": [...]} / {"data": [...]}
+def extract_bars(payload):
+    if isinstance(payload, dict):
+        payload = payload.get('bars') or payload.get('data') or []
+    return payload
+
+# one symbol/timeframe series stored as parallel arrays of doubles
+class BarSeries:
+    def __init__(self):
+        self.columns = {field: array('d') for field in BAR_FIELDS}
+        self.fetched_at = 0.0
+        self.lock = threading.Lock()
+        # downsampled slices keyed by (start, end, limit, points), dropped on every merge
+        self.downsampled = OrderedDict()
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    @property
+    def last_time(self):
+        times = self.columns['time']
+        return times[-1] if times else None
+
+    def merge(self, bars):
+        rows = []
+        for bar in bars:
+            try:
+                ts = parse_bar_time(bar.get('bucket_time', bar.get('time')))
+                rows.append((ts, float(bar['open']), float(bar['high']), float(bar['low']), float(bar['close']), float(bar.get('volume') or 0)))
+            except (KeyError, TypeError, ValueError):
+                continue
+        if not rows:
+            return 0
+        rows.sort()
+        self.downsampled.clear()
+
+        # everything from the first incoming bar onwards is replaced, which also
+        # overwrites the still forming last bar with its latest values
+        cut = bisect_left(self.columns['time'], rows[0][0])
+        added = 0
+        last_ts = None
+        for field in BAR_FIELDS:
+            del self.columns[field][cut:]
+        for row in rows:
+            if row[0] == last_ts:
+                continue
+            last_ts = row[0]
+            for field, value in zip(BAR_FIELDS, row):
+                self.columns[field].append(value)
+            added += 1
+        self.trim()
+        return added
+
+    # incremental refreshes only ever append, so without this a series grows for as long as the process runs
+    def trim(self, max_bars=None):
+        max_bars = HISTORY_MAX_BARS if max_bars is None else max_bars
+        excess = len(self) - max_bars
+        if max_bars <= 0 or excess <= 0:
+            return 0
+        for field in BAR_FIELDS:
+            del self.columns[field][:excess]
+        self.downsampled.clear()
+        return excess
+
+    def _bounds(self, start, end, limit):
+        times = self.columns['time']
+        lo = bisect_left(times, start) if start is not None else 0
+        hi = bisect_right(times, end) if end is not None else len(times)
+        if limit and hi - lo > limit:
+            lo = hi - limit
+        return lo, hi
+
+    @staticmethod
+    def _rows(cols):
+        return [
+            {'time': int(t) if t.is_integer() else t, 'open': o, 'high': h, 'low': l, 'close': c, 'volume': v}
+            for t, o, h, l, c, v in zip(*cols)
+        ]
+
+    def slice(self, start=None, end=None, limit=None):
+        lo, hi = self._bounds(start, end, limit)
+        return self._rows([self.columns[field][lo:hi] for field in BAR_FIELDS])
+
+    # merges runs of neighbouring bars into at most `points` candles, keeping each run's
+    # first open, highest high, lowest low, last close and total volume so spikes survive
+    def downsample(self, points, start=None, end=None, limit=None):
+        key = (start, end, limit, points)
+        cached = self.downsampled.get(key)
+        if cached is not None:
+            self.downsampled.move_to_end(key)
+            return cached
+
+        lo, hi = self._bounds(start, end, limit)
+        count = hi - lo
+        if count <= points or points < 2:
+            bars = self.slice(start, end, limit)
+        else:
+            times, opens, highs, lows, closes, volumes = (self.columns[field] for field in BAR_FIELDS)
+            # the last bar is left alone so live trades can still be stitched onto it
+            buckets = points - 1
+            edges = [lo + (count - 1) * i // buckets for i in range(buckets + 1)]
+            cols = tuple(array('d') for _ in BAR_FIELDS)
+            for a, b in zip(edges, edges[1:]):
+                for col, value in zip(cols, (times[a], opens[a], max(highs[a:b]), min(lows[a:b]), closes[b - 1], sum(volumes[a:b]))):
+                    col.append(value)
+            for col, field in zip(cols, BAR_FIELDS):
+                col.append(self.columns[field][hi - 1])
+            bars = self._rows(cols)
+
+        self.downsampled[key] = bars
+        while len(self.downsampled) > HISTORY_DOWNSAMPLE_CACHE:
+            self.downsampled.popitem(last=False)
+        return bars
+
+    def to_bytes(self):
+        header = json.dumps({'count': len(self), 'fetched_at': self.fetched_at}).encode()
+        return header + b'\n' + b''.join(self.columns[field].tobytes() for field in BAR_FIELDS)
+
+    @classmethod
+    def from_bytes(cls, data):
+        header, body = data.split(b'\n', 1)
+        meta = json.loads(header)
+        series = cls()
+        width = meta['count'] * array('d').itemsize
+        for i, field in enumerate(BAR_FIELDS):
+            series.columns[field].frombytes(body[i * width:(i + 1) * width])
+        series.fetched_at = meta['fetched_at']
+        # files written before HISTORY_MAX_BARS (or with a higher one) are cut down too
+        series.trim()
+        return series
+
+# in memory (optionally disk backed) store of bar series keyed by (symbol, timeframe)
+class BarStore:
+    def __init__(self, max_series=500, cache_dir=None):
+        self.max_series = max_series
+        self.cache_dir = cache_dir
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        symbol, timeframe = key
+        safe = ''.join(ch for ch in f"{symbol}_{timeframe}" if ch.isalnum() or ch in '._-')
+        return os.path.join(self.cache_dir, f"{safe}.bars")
+
+    def get(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        with self._lock:
+            series = self._series.get(key)
+            if series is not None:
+                self._series.move_to_end(key)
+                return series
+
+        series = self._load(key) or BarSeries()
+        with self._lock:
+            # another thread may have created it while we were reading the disk
+            series = self._series.setdefault(key, series)
+            self._series.move_to_end(key)
+            while len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+        return series
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                return BarSeries.from_bytes(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Bar Cache Load Error {key}: {e}")
+            return None
+
+    def save(self, symbol, timeframe, series):
+        if not self.cache_dir:
+            return
+        path = self._path((symbol, timeframe))
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(series.to_bytes())
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            print(f"Bar Cache Save Error {symbol} {timeframe}: {e}")
+
+bar_store = BarStore(max_series=HISTORY_CACHE_MAX_SERIES, cache_dir=HISTORY_CACHE_DIR)
+
+def parse_optional_float(value):
+    if value in (None, ''):
+        return None
+    value = float(value)
+    # float() accepts 'nan' and 'inf', neither is a usable timestamp
+    if not math.isfinite(value):
+        raise ValueError(f"{value} is not a finite number")
+    return value
+
+# brings the cached series up to date, the returned response is only set when the
+# upstream failed and there is nothing cached to fall back on
+def series_max_age(timeframe):
+    return min(TIMEFRAME_SECONDS.get(timeframe, HISTORY_MAX_STALENESS), HISTORY_MAX_STALENESS)
+
+def refresh_series(symbol, timeframe):
+    series = bar_store.get(symbol, timeframe)
+    if history_client is None:
+        return series, None
+
+    # the lock also stops concurrent requests for the same series fetching twice
+    with series.lock:
+        if time.time() - series.fetched_at < series_max_age(timeframe):
+            return series, None
+
+        params = {'symbol': symbol, 'timeframe': timeframe}
+        if len(series):
+            # only ask for bars from the last (possibly still open) one onwards
+            params[HISTORY_SINCE_PARAM] = int(series.last_time)
+
+        try:
+            response = history_client.get('', params=params)
+        except requests.RequestException as e:
+            # cached bars are still worth showing while the backend is down
+            if not len(series):
+                raise
+            print(f"History Refresh Failed {symbol} {timeframe}: {e}")
+            return series, None
+
+        if response.status_code == 200:
+            series.merge(extract_bars(response.json()))
+            series.fetched_at = time.time()
+            bar_store.save(symbol, timeframe, series)
+        elif not len(series):
+            return series, response
+        else:
+            print(f"History Refresh Failed {symbol} {timeframe}: {response.status_code}")
+    return series, None
 
 @app.route('/api/history', methods=['GET'])
 @login_required
@@ -839,28 +3006,277 @@ def get_history():
     timeframe = request.args.get('timeframe', '1h')
     
     # Proxy to the provided backend
-    external_api_url = os.getenv('TAILSCALE_HISTORY_URL')
-    
-    if not external_api_url:
+    if history_client is None:
         return jsonify({'error': 'Tailscale URL not configured'}), 500
-    
+
+    if not symbol:
+        return jsonify({'error': 'Symbol is required'}), 400
+
     try:
-        # verify=False bypasses the Certificate Transparency check that browsers enforce
-        response = requests.get(
-            external_api_url, 
-            params={'symbol': symbol, 'timeframe': timeframe},
-            verify=False 
-        )
-        
-        if response.status_code == 200:
-            return jsonify(response.json())
+        start = parse_optional_float(request.args.get('start'))
+        end = parse_optional_float(request.args.get('end'))
+        limit = int(request.args.get('limit')) if request.args.get('limit') else None
+        if limit is not None and limit <= 0:
+            raise ValueError('limit must be positive')
+        # max_points wins over width, which is the chart's width in pixels
+        if request.args.get('max_points'):
+            points = int(request.args.get('max_points'))
+        elif request.args.get('width'):
+            points = int(float(request.args.get('width')) / HISTORY_PIXELS_PER_BAR)
         else:
-            return jsonify({'error': 'Failed to fetch history', 'details': response.text}), response.status_code
+            points = None
+    except (ValueError, OverflowError):
+        return jsonify({'error': 'Invalid range parameters'}), 400
+    if points is not None:
+        points = min(max(points, HISTORY_MIN_POINTS), HISTORY_MAX_POINTS)
+
+    try:
+        series, failed = refresh_series(symbol.upper(), timeframe)
+        if failed is not None:
+            return jsonify({'error': 'Failed to fetch history', 'details': failed.text}), failed.status_code
+
+        with series.lock:
+            if points:
+                bars = series.downsample(points, start, end, limit)
+            else:
+                bars = series.slice(start, end, limit)
+            age = time.time() - series.fetched_at
+
+        # the refresh failed and these are the last bars we managed to fetch
+        return mark_stale(jsonify(bars), age if age >= series_max_age(timeframe) else None)
             
+    except (CircuitOpenError, RateLimitTimeout) as e:
+        return upstream_unavailable(e)
     except Exception as e:
         print(f"History Proxy Error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 
+# portfolio analytics
+
+ANALYTICS_BENCHMARK = os.getenv('ANALYTICS_BENCHMARK', 'SPY')
+ANALYTICS_LOOKBACK = int(os.getenv('ANALYTICS_LOOKBACK', '90'))
+ANALYTICS_CACHE_SIZE = int(os.getenv('ANALYTICS_CACHE_SIZE', '1024'))
+ANALYTICS_CACHE_TTL = float(os.getenv('ANALYTICS_CACHE_TTL', '30'))
+ANALYTICS_MIN_COVERAGE = float(os.getenv('ANALYTICS_MIN_COVERAGE', '0.8'))
+HISTORY_FETCH_WORKERS = int(os.getenv('HISTORY_FETCH_WORKERS', '4'))
+TRADING_DAYS = 252
+
+POSITION_FIELDS = ('qty', 'market_value', 'cost_basis', 'unrealized_pl')
+# the fields that only change when the holdings do, prices move every tick
+HOLDING_FIELDS = ('symbol', 'side', 'qty', 'cost_basis')
+
+history_executor = ThreadPoolExecutor(max_workers=HISTORY_FETCH_WORKERS, thread_name_prefix='history')
+
+# last computed analytics per account, keyed by a fingerprint of its holdings
+analytics_cache = OrderedDict()
+analytics_lock = threading.Lock()
+
+def load_closes(symbols, timeframe='1d'):
+    def load(symbol):
+        try:
+            series, _ = refresh_series(symbol, timeframe)
+        except Exception as e:
+            print(f"Analytics History Error {symbol}: {e}")
+            series = bar_store.get(symbol, timeframe)
+        # copied so a concurrent merge can't change the arrays under numpy
+        with series.lock:
+            return array('d', series.columns['time']), array('d', series.columns['close'])
+
+    return dict(zip(symbols, history_executor.map(load, symbols)))
+
+def rounded(value, digits=6):
+    value = float(value)
+    return round(value, digits) if value == value and abs(value) != float('inf') else None
+
+def compute_risk(np, symbols, weights, closes):
+    bench_times, bench_closes = closes.get(ANALYTICS_BENCHMARK) or (array('d'), array('d'))
+    risk = {
+        'benchmark': ANALYTICS_BENCHMARK,
+        'lookback_days': ANALYTICS_LOOKBACK,
+        'observations': 0,
+        'volatility': None,
+        'beta': None,
+        'symbols': {},
+        'excluded': []
+    }
+    # every holding is aligned onto the benchmark's trading days
+    times = np.asarray(bench_times)[-(ANALYTICS_LOOKBACK + 1):]
+    bench = np.asarray(bench_closes)[-(ANALYTICS_LOOKBACK + 1):]
+    if len(times) < 3:
+        risk['excluded'] = list(symbols)
+        return risk
+
+    included, columns = [], []
+    for i, symbol in enumerate(symbols):
+        symbol_times, symbol_closes = closes.get(symbol) or (array('d'), array('d'))
+        t = np.asarray(symbol_times)
+        if not len(t):
+            risk['excluded'].append(symbol)
+            continue
+        index = np.searchsorted(t, times).clip(max=len(t) - 1)
+        hit = t[index] == times
+        if hit.mean() < ANALYTICS_MIN_COVERAGE:
+            risk['excluded'].append(symbol)
+            continue
+        included.append(i)
+        columns.append(np.where(hit, np.asarray(symbol_closes)[index], np.nan))
+
+    if not included:
+        return risk
+
+    prices = np.column_stack(columns)
+    # days where any price is missing are dropped, NaN compares false here
+    rows = (prices > 0).all(axis=1) & (bench > 0)
+    prices, bench = prices[rows], bench[rows]
+    if len(bench) < 3:
+        risk['excluded'] = list(symbols)
+        return risk
+
+    returns = np.diff(np.log(prices), axis=0)
+    bench_returns = np.diff(np.log(bench))
+    w = weights[included]
+    gross = np.abs(w).sum()
+    w = w / gross if gross else w
+    portfolio = returns @ w
+
+    bench_centered = bench_returns - bench_returns.mean()
+    bench_var = bench_centered @ bench_centered
+    scale = np.sqrt(TRADING_DAYS)
+    vols = returns.std(axis=0, ddof=1) * scale
+    betas = ((returns - returns.mean(axis=0)).T @ bench_centered) / bench_var if bench_var else np.full(len(included), np.nan)
+
+    risk['observations'] = int(len(bench_returns))
+    risk['volatility'] = rounded(portfolio.std(ddof=1) * scale)
+    risk['beta'] = rounded(((portfolio - portfolio.mean()) @ bench_centered) / bench_var) if bench_var else None
+    risk['symbols'] = {
+        symbols[i]: {'volatility': rounded(vol), 'beta': rounded(beta)}
+        for i, vol, beta in zip(included, vols, betas)
+    }
+    return risk
+
+def build_portfolio_analytics(positions):
+    # imported here so numpy doesn't add to cold start for every other route
+    import numpy as np
+
+    if not positions:
+        return {
+            'as_of': datetime.utcnow().isoformat() + 'Z',
+            'total_market_value': 0.0,
+            'total_cost_basis': 0.0,
+            'unrealized_pl': 0.0,
+            'unrealized_plpc': None,
+            'positions': [],
+            'sectors': [],
+            'concentration': {'hhi': None, 'effective_positions': None, 'top_weight': None, 'top5_weight': None},
+            'risk': None
+        }
+
+    symbols = [str(p.get('symbol', '')).upper() for p in positions]
+    values = np.array([[float(p.get(field) or 0) for field in POSITION_FIELDS] for p in positions], dtype=float)
+    qty, market_value, cost_basis, unrealized_pl = values.T
+
+    total_value = market_value.sum()
+    total_cost = cost_basis.sum()
+    gross = np.abs(market_value).sum()
+    # weights are over gross exposure so short positions can't push the total towards zero
+    weights = market_value / gross if gross else np.zeros(len(symbols))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plpc = np.where(cost_basis != 0, unrealized_pl / np.abs(cost_basis), 0.0)
+
+    sectors = np.array([(symbol_registry.get(symbol) or {}).get('sector') or 'Other' for symbol in symbols])
+    names, inverse = np.unique(sectors, return_inverse=True)
+    sector_value = np.bincount(inverse, weights=market_value, minlength=len(names))
+    sector_weight = np.bincount(inverse, weights=weights, minlength=len(names))
+    sector_pl = np.bincount(inverse, weights=unrealized_pl, minlength=len(names))
+
+    order = np.argsort(-np.abs(weights), kind='stable')
+    hhi = float((weights ** 2).sum())
+
+    closes = load_closes(list(dict.fromkeys(symbols + [ANALYTICS_BENCHMARK])))
+
+    return {
+        'as_of': datetime.utcnow().isoformat() + 'Z',
+        'total_market_value': rounded(total_value, 2),
+        'total_cost_basis': rounded(total_cost, 2),
+        'unrealized_pl': rounded(unrealized_pl.sum(), 2),
+        'unrealized_plpc': rounded(unrealized_pl.sum() / abs(total_cost)) if total_cost else None,
+        'positions': [
+            {
+                'symbol': symbols[i],
+                'sector': str(sectors[i]),
+                'qty': rounded(qty[i]),
+                'market_value': rounded(market_value[i], 2),
+                'weight': rounded(weights[i]),
+                'unrealized_pl': rounded(unrealized_pl[i], 2),
+                'unrealized_plpc': rounded(plpc[i])
+            }
+            for i in order
+        ],
+        'sectors': [
+            {
+                'sector': str(names[i]),
+                'market_value': rounded(sector_value[i], 2),
+                'weight': rounded(sector_weight[i]),
+                'unrealized_pl': rounded(sector_pl[i], 2)
+            }
+            for i in np.argsort(-np.abs(sector_weight), kind='stable')
+        ],
+        'concentration': {
+            'hhi': rounded(hhi),
+            'effective_positions': rounded(1 / hhi, 2) if hhi else None,
+            'top_weight': rounded(abs(weights[order[0]])),
+            'top5_weight': rounded(np.abs(weights[order[:5]]).sum())
+        },
+        'risk': compute_risk(np, symbols, weights, closes)
+    }
+
+@app.route('/api/portfolio/analytics', methods=['GET'])
+@login_required
+def get_portfolio_analytics():
+    alpaca_id = current_user.alpaca_account_id
+    if not alpaca_id:
+        return jsonify({'error': 'No trading account found'}), 400
+
+    try:
+        # same cache key as /api/positions so either route can fall back on the other's data
+        response, stale_age = last_known_good.fetch(('positions', alpaca_id), lambda: alpaca.get(f"/trading/accounts/{alpaca_id}/positions"))
+        if response.status_code != 200:
+            return jsonify({'error': 'Failed to fetch positions', 'details': response.text}), response.status_code
+
+        positions = response.json()
+        # reused while the holdings are unchanged, for at most ANALYTICS_CACHE_TTL so the values follow the market
+        holdings = sorted(tuple(str(p.get(field)) for field in HOLDING_FIELDS) for p in positions)
+        fingerprint = hashlib.sha1(repr(holdings).encode()).hexdigest()
+        with analytics_lock:
+            cached = analytics_cache.get(alpaca_id)
+            if cached and cached[0] == fingerprint and time.monotonic() - cached[1] < ANALYTICS_CACHE_TTL:
+                analytics_cache.move_to_end(alpaca_id)
+                return mark_stale(jsonify(cached[2]), stale_age)
+
+        result = build_portfolio_analytics(positions)
+
+        with analytics_lock:
+            analytics_cache[alpaca_id] = (fingerprint, time.monotonic(), result)
+            analytics_cache.move_to_end(alpaca_id)
+            while len(analytics_cache) > ANALYTICS_CACHE_SIZE:
+                analytics_cache.popitem(last=False)
+
+        return mark_stale(jsonify(result), stale_age)
+    except (CircuitOpenError, RateLimitTimeout) as e:
+        return upstream_unavailable(e)
+    except Exception as e:
+        print(f"Portfolio Analytics Error: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
 if __name__ == '__main__':
+    print("--------------------------------------------------")
+    print("PenguinTrader Backend Loaded - API Routes Registered")
+    print("--------------------------------------------------")
+    # local runs keep the schema up to date, deployments run `flask --app app migrate`
+    try:
+        run_migrations()
+    except Exception as e:
+        print(f"Migration Error: {e}")
     app.run(port=5001, debug=True)
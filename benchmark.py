@@ -0,0 +1,386 @@
+import argparse
+import json
+import os
+import queue
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Load test for the real Flask routes.
+#
+# Against an app that is already running:
+#   python benchmark.py --url http://127.0.0.1:5001
+#
+# Fully local, starting the fake broker/history server and the app in this process
+# (still needs SUPABASE_DB_URL pointing at a Postgres database, e.g. a local one):
+#   python benchmark.py --start-fakes --start-app --migrate --concurrency 20 --requests 500
+#
+# Cold start (import app.py and serve a first request in a fresh interpreter):
+#   python benchmark.py --startup 10
+#
+# JSON encoding time and compressed size of representative payloads, no server needed:
+#   python benchmark.py --serialization 200
+
+DEFAULT_ROUTES = ['login', 'watchlists', 'account', 'positions', 'order', 'history']
+BENCH_PASSWORD = 'Bench-Password-1'
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # nearest rank
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def start_fakes(latency, error_rate):
+    import fakebroker
+
+    broker = fakebroker.FakeBroker(latency=latency, jitter=latency / 4, error_rate=error_rate)
+    server = fakebroker.start_server(broker, port=0)
+    host, port = server.server_address[:2]
+    # must be set before app is imported, it reads them at import time
+    os.environ['ALPACA_BROKER_URL'] = f"http://{host}:{port}/v1"
+    os.environ['ALPACA_DATA_URL'] = f"http://{host}:{port}/v2"
+    os.environ['TAILSCALE_HISTORY_URL'] = f"http://{host}:{port}/history"
+    print(f"Fake broker on http://{host}:{port}")
+    return broker
+
+
+def start_app(migrate=False):
+    from werkzeug.serving import make_server
+    import app as penguin
+
+    if migrate:
+        penguin.run_migrations()
+    server = make_server('127.0.0.1', 0, penguin.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='app', daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    print(f"App on {url}")
+    return url
+
+
+# runs in a fresh interpreter so nothing is already imported or cached
+STARTUP_SCRIPT = '''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get(%r)
+finished = time.perf_counter()
+print(json.dumps({"import": imported - started, "first_response": finished - imported, "status": response.status_code}))
+'''
+
+
+def measure_startup(runs, path):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT % path],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True
+        )
+        total = time.perf_counter() - started
+        if result.returncode != 0:
+            sys.exit(f"Startup run failed:\n{result.stderr}")
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        sample['process'] = total
+        samples.append(sample)
+
+    print()
+    print(f"Cold start over {runs} runs, first request GET {path} ({samples[0]['status']})")
+    print(f"{'phase':<16}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for phase in ('import', 'first_response', 'process'):
+        values = [s[phase] * 1000 for s in samples]
+        print(f"{phase:<16}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+    return samples
+
+
+def create_user(url, timeout):
+    session = requests.Session()
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    response = session.post(f"{url}/signup", data={
+        'email': email,
+        'password': BENCH_PASSWORD,
+        'first_name': 'Bench',
+        'last_name': 'User',
+        'terms': 'on'
+    }, allow_redirects=False)
+    if response.status_code != 302:
+        sys.exit(f"Signup failed ({response.status_code}), is the database reachable?")
+
+    # the trading account is provisioned in the background after signup
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        jobs = session.get(f"{url}/api/jobs")
+        if jobs.ok and jobs.json().get('trading_account_ready'):
+            break
+        time.sleep(0.5)
+    else:
+        print("Warning: trading account not ready, trading routes will fail")
+
+    return email
+
+
+def login(url, email):
+    session = requests.Session()
+    response = session.post(f"{url}/login", data={'email': email, 'password': BENCH_PASSWORD}, allow_redirects=False)
+    if response.status_code != 302:
+        sys.exit(f"Login failed ({response.status_code})")
+    return session
+
+
+def load_symbols():
+    try:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stocks.json')) as f:
+            return [s['symbol'] for s in json.load(f)] or ['AAPL']
+    except Exception:
+        return ['AAPL']
+
+
+def make_routes(url, email, symbols):
+    counter = {'n': 0}
+    lock = threading.Lock()
+
+    def next_index():
+        with lock:
+            counter['n'] += 1
+            return counter['n']
+
+    # every route returns (ok, response)
+    def login_route(session):
+        # measured with a fresh cookie jar every time
+        response = requests.post(f"{url}/login", data={'email': email, 'password': BENCH_PASSWORD}, allow_redirects=False)
+        return response.status_code == 302 and '/dashboard' in response.headers.get('Location', ''), response
+
+    def watchlists_route(session):
+        response = session.get(f"{url}/api/watchlists")
+        return response.ok, response
+
+    def account_route(session):
+        response = session.get(f"{url}/api/account_info")
+        return response.ok, response
+
+    def positions_route(session):
+        response = session.get(f"{url}/api/positions")
+        return response.ok, response
+
+    def order_route(session):
+        # alternate buys and sells so the account never runs out of cash or shares
+        side = 'buy' if next_index() % 2 else 'sell'
+        response = session.post(f"{url}/api/order", json={'symbol': symbols[0], 'qty': 1, 'side': side})
+        return response.ok or (side == 'sell' and response.status_code == 403), response
+
+    def analytics_route(session):
+        response = session.get(f"{url}/api/portfolio/analytics")
+        return response.ok, response
+
+    def history_route(session):
+        symbol = symbols[next_index() % len(symbols)]
+        response = session.get(f"{url}/api/history", params={'symbol': symbol, 'timeframe': '1h'})
+        return response.ok, response
+
+    def stocks_route(session):
+        response = session.get(f"{url}/api/stocks")
+        return response.ok, response
+
+    return {
+        'login': login_route,
+        'watchlists': watchlists_route,
+        'account': account_route,
+        'positions': positions_route,
+        'analytics': analytics_route,
+        'order': order_route,
+        'history': history_route,
+        'stocks': stocks_route
+    }
+
+
+def run_route(fn, sessions, total, concurrency):
+    latencies = []
+    errors = 0
+    wire_bytes = 0
+    lock = threading.Lock()
+
+    def task():
+        nonlocal errors, wire_bytes
+        session = sessions.get()
+        try:
+            started = time.perf_counter()
+            try:
+                ok, response = fn(session)
+                # Content-Length is the compressed size, requests has already decoded .content
+                size = int(response.headers.get('Content-Length') or len(response.content))
+            except requests.RequestException:
+                ok, size = False, 0
+            elapsed = time.perf_counter() - started
+        finally:
+            sessions.put(session)
+        with lock:
+            latencies.append(elapsed)
+            wire_bytes += size
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(total):
+            pool.submit(task)
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'errors': errors,
+        'rps': total / wall if wall else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+        'avg_bytes': wire_bytes / total if total else 0.0
+    }
+
+
+def print_report(results):
+    print()
+    print(f"{'route':<12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'avg bytes':>12}")
+    for name, r in results.items():
+        print(f"{name:<12}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}{r['avg_bytes']:>12.0f}")
+
+
+# payloads shaped like what the real routes send
+def sample_payloads(symbols):
+    import fakebroker
+    from datetime import datetime, timezone
+
+    broker = fakebroker.FakeBroker(history_bars=2000, seed=1)
+    account = broker.accounts[broker.new_account(100000)]
+    for i, symbol in enumerate(symbols[:50]):
+        account['positions'][symbol] = {'qty': float(i + 1), 'avg_entry_price': broker.price(symbol)}
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stocks.json')) as f:
+        stocks = json.load(f)
+
+    created_at = datetime.now(timezone.utc)
+    return {
+        'stocks': stocks,
+        'positions': broker.positions_json(account),
+        'history': broker.history(symbols[0], '1h')[1],
+        'watchlists': [
+            {'id': str(uuid.uuid4()), 'name': f"List {i}", 'position': i, 'created_at': created_at, 'symbols': symbols[:20]}
+            for i in range(10)
+        ]
+    }
+
+
+def measure_serialization(rounds, symbols):
+    import app as penguin
+
+    def stdlib_encode(obj):
+        # what Flask's default provider does
+        return json.dumps(obj, default=str, sort_keys=True, separators=(',', ':')).encode()
+
+    provider = penguin.app.json
+    encoders = {'json': stdlib_encode}
+    if penguin.orjson is not None:
+        encoders['orjson'] = lambda obj: penguin.orjson.dumps(obj, default=provider.default, option=penguin.orjson.OPT_NON_STR_KEYS)
+    encodings = ['gzip'] + (['br'] if penguin.brotli is not None else [])
+
+    results = {}
+    for name, payload in sample_payloads(symbols).items():
+        row = {}
+        for encoder, encode in encoders.items():
+            started = time.perf_counter()
+            for _ in range(rounds):
+                body = encode(payload)
+            row[f"{encoder}_us"] = (time.perf_counter() - started) / rounds * 1e6
+        row['identity_bytes'] = len(body)
+        for encoding in encodings:
+            started = time.perf_counter()
+            for _ in range(rounds):
+                compressed = penguin.compress_body(body, encoding)
+            row[f"{encoding}_bytes"] = len(compressed)
+            row[f"{encoding}_us"] = (time.perf_counter() - started) / rounds * 1e6
+        results[name] = row
+
+    columns = [c for c in results[next(iter(results))]]
+    print()
+    print(f"Serialization over {rounds} rounds (us per call, bytes per body)")
+    print(f"{'payload':<12}" + ''.join(f"{c:>16}" for c in columns))
+    for name, row in results.items():
+        print(f"{name:<12}" + ''.join(f"{row[c]:>16.1f}" if c.endswith('_us') else f"{row[c]:>16}" for c in columns))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the PenguinTrader Flask routes')
+    parser.add_argument('--url', help='base url of a running app')
+    parser.add_argument('--start-fakes', action='store_true', help='start the fake broker/history server in process')
+    parser.add_argument('--start-app', action='store_true', help='serve app.py in process instead of using --url')
+    parser.add_argument('--fake-latency', type=float, default=0.05, help='seconds of latency added by the fake broker')
+    parser.add_argument('--fake-error-rate', type=float, default=0.0, help='fraction of fake broker requests that fail')
+    parser.add_argument('--routes', default=','.join(DEFAULT_ROUTES), help='comma separated routes to run')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests per route before measuring')
+    parser.add_argument('--provision-timeout', type=float, default=30)
+    parser.add_argument('--migrate', action='store_true', help='apply database migrations before --start-app')
+    parser.add_argument('--startup', type=int, metavar='RUNS', help='only measure import-to-first-response over RUNS fresh processes')
+    parser.add_argument('--startup-path', default='/api/stocks', help='route requested by --startup')
+    parser.add_argument('--serialization', type=int, metavar='ROUNDS', help='only measure JSON encoding and compression of sample payloads')
+    parser.add_argument('--accept-encoding', help='Accept-Encoding sent by the load test, e.g. identity to turn compression off')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    if args.startup:
+        samples = measure_startup(args.startup, args.startup_path)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'startup': samples}, f, indent=2)
+        sys.exit(0)
+
+    if args.serialization:
+        results = measure_serialization(args.serialization, load_symbols())
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'serialization': results}, f, indent=2)
+        sys.exit(0)
+
+    if args.start_fakes:
+        start_fakes(args.fake_latency, args.fake_error_rate)
+    url = start_app(args.migrate) if args.start_app else args.url
+    if not url:
+        parser.error('either --url or --start-app is required')
+    url = url.rstrip('/')
+
+    email = create_user(url, args.provision_timeout)
+    sessions = queue.Queue()
+    for _ in range(args.concurrency):
+        session = login(url, email)
+        if args.accept_encoding:
+            session.headers['Accept-Encoding'] = args.accept_encoding
+        sessions.put(session)
+
+    routes = make_routes(url, email, load_symbols())
+    results = {}
+    for name in args.routes.split(','):
+        name = name.strip()
+        if name not in routes:
+            parser.error(f"unknown route {name}, choose from {', '.join(routes)}")
+        if args.warmup:
+            run_route(routes[name], sessions, args.warmup, args.concurrency)
+        print(f"Running {name}: {args.requests} requests at concurrency {args.concurrency}")
+        results[name] = run_route(routes[name], sessions, args.requests, args.concurrency)
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'url': url, 'concurrency': args.concurrency, 'routes': results}, f, indent=2)
@@ -1,83 +1,301 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 
 
-API_KEY = "CKWZXV6O4C7P5ZPGKPZ72KYZQH"
-API_SECRET = "GeUEsQeEdVqbp1FRorhfVZJJgQ4fviGahFmhyVXGuek7"
-BASE_URL = "https://broker-api.sandbox.alpaca.markets/v1"
+API_KEY = os.getenv("ALPACA_BROKER_KEY", "CKWZXV6O4C7P5ZPGKPZ72KYZQH")
+API_SECRET = os.getenv("ALPACA_BROKER_SECRET", "GeUEsQeEdVqbp1FRorhfVZJJgQ4fviGahFmhyVXGuek7")
+BASE_URL = os.getenv("ALPACA_BROKER_URL", "https://broker-api.sandbox.alpaca.markets/v1").rstrip('/')
 
 AUTH = HTTPBasicAuth(API_KEY, API_SECRET)
 
-def cancel_all_transfers():
-    print("\nChecking for stuck Transfers (ACH)...")
-    # fetch queued transfers
+# Cancels stuck transfers and journals.
+#
+#   python canceltransactions.py --dry-run
+#   python canceltransactions.py --kind journals --older-than 2h --max-amount 50000
+#   python canceltransactions.py --account <account id> --workers 16 --rate 20
+
+
+RATE_LIMIT_ATTEMPTS = 5
+
+
+def make_session(pool_size):
+    # DELETE is idempotent so 5xx can be retried here. 429s are left to send(), a retry in
+    # the adapter would only hold back its own worker while the others keep going
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.auth = AUTH
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# shared by every worker so the pool as a whole stays under `rate` requests per second
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # with no rate limit this still waits out a backoff()
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(self.next_at, now)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+    def backoff(self, seconds):
+        # the API answered 429, hold every worker back for a while
+        with self.lock:
+            self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+
+def retry_after(response, default=5.0):
+    # seconds form only, an HTTP date falls back to the default
     try:
-        # get list of all transfers
-        response = requests.get(f"{BASE_URL}/transfers?status=queued", auth=AUTH)
-        queued_transfers = response.json()
-        
-        # also check pending
-        response_pending = requests.get(f"{BASE_URL}/transfers?status=pending", auth=AUTH)
-        pending_transfers = response_pending.json()
-        
-        all_stuck = queued_transfers + pending_transfers
-        
-        if not all_stuck:
-            print("No stuck transfers found.")
-            return
+        return max(0.0, float(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return default
 
-        print(f"found {len(all_stuck)} stuck transfers. Canceling now...")
 
-        for transfer in all_stuck:
-            t_id = transfer['id']
-            # delete cancels it
-            del_resp = requests.delete(f"{BASE_URL}/transfers/{t_id}", auth=AUTH)
-            
-            if del_resp.status_code == 204:
-                print(f"Cancelled Transfer {t_id}")
-            else:
-                print(f"Could not cancel {t_id}: {del_resp.status_code}")
+# every request goes through the shared limiter, a 429 pauses all workers for Retry-After
+# and the request is tried again
+def send(session, limiter, method, url, **kwargs):
+    for _ in range(RATE_LIMIT_ATTEMPTS):
+        limiter.wait()
+        response = session.request(method, url, **kwargs)
+        if response.status_code != 429:
+            return response
+        limiter.backoff(retry_after(response))
+    return response
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
 
-    except Exception as e:
-        print(f"Error checking transfers: {e}")
+def parse_duration(value):
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
 
-def cancel_all_journals():
-    print("\nChecking for stuck Journals (JNLC)...")
-    # fetch pending journals
+
+def parse_time(value):
+    if not value:
+        return None
     try:
-        response = requests.get(f"{BASE_URL}/journals?status=pending", auth=AUTH)
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def fetch_transfers(session, limiter, status, args):
+    # /transfers pages with limit and offset
+    page_size = args.page_size
+    seen = set()
+    offset = 0
+    while True:
+        response = send(session, limiter, 'GET', f"{BASE_URL}/transfers", params={'status': status, 'limit': page_size, 'offset': offset})
         if response.status_code != 200:
-            print("Could not fetch journals.")
+            print(f"Could not fetch {status} transfers: {response.status_code} {response.text}")
             return
+        page = response.json()
+        fresh = [t for t in page if t['id'] not in seen]
+        for transfer in fresh:
+            seen.add(transfer['id'])
+            yield transfer
+        # a short page is the last one, a page of repeats means offset was ignored
+        if len(page) < page_size or not fresh:
+            return
+        offset += len(page)
 
-        journals = response.json()
-        
-        # also check queued
-        resp_q = requests.get(f"{BASE_URL}/journals?status=queued", auth=AUTH)
-        if resp_q.status_code == 200:
-            journals += resp_q.json()
 
-        if not journals:
-            print("No stuck journals found.")
-            return
+def fetch_journals(session, limiter, status, args):
+    # /journals takes no limit or offset and returns every journal matching the filters,
+    # so one request per status gets them all
+    response = send(session, limiter, 'GET', f"{BASE_URL}/journals", params={'status': status})
+    if response.status_code != 200:
+        print(f"Could not fetch {status} journals: {response.status_code} {response.text}")
+        return
+    yield from response.json()
 
-        print(f"Found {len(journals)} stuck journals. Canceling now...")
 
-        for journal in journals:
-            j_id = journal['id']
-            # delete cancels it
-            del_resp = requests.delete(f"{BASE_URL}/journals/{j_id}", auth=AUTH)
-            
-            if del_resp.status_code == 204:
-                print(f"Cancelled Journal {j_id}")
+KINDS = {
+    'transfers': {
+        'fetch': fetch_transfers,
+        'path': 'transfers',
+        'accounts': ('account_id',),
+        'amount': ('amount',),
+        'created': ('created_at', 'updated_at')
+    },
+    'journals': {
+        'fetch': fetch_journals,
+        'path': 'journals',
+        'accounts': ('from_account', 'to_account'),
+        'amount': ('net_amount', 'amount'),
+        'created': ('created_at', 'system_date', 'settle_date')
+    }
+}
+
+
+def first_value(item, fields):
+    for field in fields:
+        if item.get(field) not in (None, ''):
+            return item[field]
+    return None
+
+
+def matches(item, kind, args, now):
+    spec = KINDS[kind]
+    if args.account and not any(item.get(field) in args.account for field in spec['accounts']):
+        return False
+
+    if args.min_amount is not None or args.max_amount is not None:
+        try:
+            amount = abs(float(first_value(item, spec['amount'])))
+        except (TypeError, ValueError):
+            return False
+        if args.min_amount is not None and amount < args.min_amount:
+            return False
+        if args.max_amount is not None and amount > args.max_amount:
+            return False
+
+    if args.older_than is not None:
+        created = parse_time(first_value(item, spec['created']))
+        if created is None or (now - created).total_seconds() < args.older_than:
+            return False
+
+    return True
+
+
+def collect(session, limiter, kind, args):
+    now = datetime.now(timezone.utc)
+    found = {}
+    for status in args.status:
+        for item in KINDS[kind]['fetch'](session, limiter, status, args):
+            if item['id'] not in found and matches(item, kind, args, now):
+                found[item['id']] = item
+    return list(found.values())
+
+
+def cancel_one(session, limiter, kind, item_id):
+    # delete cancels it
+    response = send(session, limiter, 'DELETE', f"{BASE_URL}/{KINDS[kind]['path']}/{item_id}")
+    return response.status_code, response.text
+
+
+def cancel_all(kind, args, session, limiter, summary):
+    print(f"\nChecking for stuck {kind} ({', '.join(args.status)})...")
+    started = time.perf_counter()
+    items = collect(session, limiter, kind, args)
+    summary['listed_seconds'] += time.perf_counter() - started
+    summary['matched'] += len(items)
+
+    if not items:
+        print(f"No stuck {kind} found.")
+        return
+
+    if args.dry_run:
+        print(f"Found {len(items)} stuck {kind}, dry run so nothing is cancelled:")
+        for item in items:
+            amount = first_value(item, KINDS[kind]['amount'])
+            accounts = ' -> '.join(str(item.get(f)) for f in KINDS[kind]['accounts'])
+            print(f"  {item['id']}  {item.get('status')}  {amount}  {accounts}")
+        return
+
+    print(f"Found {len(items)} stuck {kind}. Canceling with {args.workers} workers...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(cancel_one, session, limiter, kind, item['id']): item['id'] for item in items}
+        for future in as_completed(futures):
+            item_id = futures[future]
+            try:
+                status, text = future.result()
+            except requests.RequestException as e:
+                status, text = 'error', str(e)
+            summary['statuses'][status] += 1
+            if status == 204:
+                summary['cancelled'] += 1
+                if args.verbose:
+                    print(f"Cancelled {kind[:-1]} {item_id}")
             else:
-                print(f"Could not cancel {j_id}: {del_resp.status_code}")
+                summary['failed'] += 1
+                print(f"Could not cancel {item_id}: {status} {text}")
+    summary['cancel_seconds'] += time.perf_counter() - started
+
+
+def print_summary(summary, elapsed):
+    print("\n--- SUMMARY ---")
+    print(f"Matched:    {summary['matched']}")
+    print(f"Cancelled:  {summary['cancelled']}")
+    print(f"Failed:     {summary['failed']}")
+    if summary['statuses']:
+        print(f"Statuses:   {', '.join(f'{k}={v}' for k, v in sorted(summary['statuses'].items(), key=str))}")
+    print(f"Listing:    {summary['listed_seconds']:.1f}s")
+    if summary['cancel_seconds']:
+        rate = (summary['cancelled'] + summary['failed']) / summary['cancel_seconds']
+        print(f"Cancelling: {summary['cancel_seconds']:.1f}s ({rate:.1f} requests/s)")
+    print(f"Total:      {elapsed:.1f}s")
 
-    except Exception as e:
-        print(f"Error checking journals: {e}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cancel stuck Alpaca transfers and journals')
+    parser.add_argument('--kind', choices=['transfers', 'journals', 'all'], default='all')
+    parser.add_argument('--status', default='queued,pending', help='comma separated statuses to cancel')
+    parser.add_argument('--dry-run', action='store_true', help='list what would be cancelled and stop')
+    parser.add_argument('--account', action='append', help='only items to or from this account, repeatable')
+    parser.add_argument('--older-than', type=parse_duration, metavar='AGE', help='only items created at least this long ago, e.g. 90m, 2h, 3d')
+    parser.add_argument('--min-amount', type=float)
+    parser.add_argument('--max-amount', type=float)
+    parser.add_argument('--workers', type=positive_int, default=8, help='cancel requests in flight at once')
+    parser.add_argument('--rate', type=float, default=10, help='maximum cancel requests per second, 0 for no limit')
+    parser.add_argument('--page-size', type=int, default=100, help='transfers fetched per request')
+    parser.add_argument('--verbose', action='store_true', help='print every cancelled id')
+    args = parser.parse_args()
+    args.status = [s.strip() for s in args.status.split(',') if s.strip()]
+    if args.account:
+        args.account = set(args.account)
+
+    session = make_session(args.workers)
+    limiter = RateLimiter(args.rate)
+    summary = {'matched': 0, 'cancelled': 0, 'failed': 0, 'statuses': Counter(), 'listed_seconds': 0.0, 'cancel_seconds': 0.0}
+
     print("--- STARTING CLEANUP ---")
-    cancel_all_transfers()
-    cancel_all_journals()
-    print("\n--- CLEANUP COMPLETE ---")
\ No newline at end of file
+    started = time.perf_counter()
+    kinds = ['transfers', 'journals'] if args.kind == 'all' else [args.kind]
+    try:
+        for kind in kinds:
+            cancel_all(kind, args, session, limiter, summary)
+    except KeyboardInterrupt:
+        print("\nInterrupted.")
+    except requests.RequestException as e:
+        print(f"Error talking to Alpaca: {e}")
+    print_summary(summary, time.perf_counter() - started)
+    print("\n--- CLEANUP COMPLETE ---")
+    sys.exit(1 if summary['failed'] else 0)
@@ -0,0 +1,390 @@
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-in for the Alpaca Broker API and the Tailscale history backend.
+# Point the app at it with:
+#   ALPACA_BROKER_URL=http://127.0.0.1:8001/v1
+#   ALPACA_DATA_URL=http://127.0.0.1:8001/v2
+#   TAILSCALE_HISTORY_URL=http://127.0.0.1:8001/history
+
+# seconds per bar for the timeframes the real history backend accepts, the same set as
+# TIMEFRAME_SECONDS in app.py so every chart timeframe can be exercised against the fake
+HISTORY_TIMEFRAMES = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '30m': 1800,
+    '1h': 3600,
+    '4h': 14400,
+    '1d': 86400,
+    '1w': 604800
+}
+
+
+class FakeBroker:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500, history_bars=500, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.history_bars = history_bars
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.accounts = {}
+        self.journals = []
+        self.transfers = []
+        self.requests = 0
+
+    # deterministic price per symbol that drifts slowly over time
+    def price(self, symbol, at=None):
+        at = time.time() if at is None else at
+        base = 50 + (sum(ord(c) for c in symbol) * 37) % 400
+        return round(base * (1 + 0.05 * math.sin(at / 3600 + len(symbol))), 2)
+
+    def new_account(self, cash=0.0):
+        account_id = str(uuid.uuid4())
+        self.accounts[account_id] = {'id': account_id, 'cash': cash, 'positions': {}, 'orders': []}
+        return account_id
+
+    def account_json(self, account):
+        equity = account['cash'] + sum(p['qty'] * self.price(symbol) for symbol, p in account['positions'].items())
+        return {
+            'id': account['id'],
+            'account_number': account['id'][:8].upper(),
+            'status': 'ACTIVE',
+            'currency': 'USD',
+            'cash': f"{account['cash']:.2f}",
+            'buying_power': f"{account['cash']:.2f}",
+            'equity': f"{equity:.2f}",
+            'portfolio_value': f"{equity:.2f}"
+        }
+
+    def positions_json(self, account):
+        positions = []
+        for symbol, p in account['positions'].items():
+            current = self.price(symbol)
+            market_value = p['qty'] * current
+            cost_basis = p['qty'] * p['avg_entry_price']
+            positions.append({
+                'symbol': symbol,
+                'qty': str(p['qty']),
+                'side': 'long',
+                'avg_entry_price': f"{p['avg_entry_price']:.2f}",
+                'current_price': f"{current:.2f}",
+                'market_value': f"{market_value:.2f}",
+                'cost_basis': f"{cost_basis:.2f}",
+                'unrealized_pl': f"{market_value - cost_basis:.2f}",
+                'unrealized_plpc': f"{(market_value - cost_basis) / cost_basis if cost_basis else 0:.4f}"
+            })
+        return positions
+
+    def place_order(self, account, order):
+        symbol = str(order.get('symbol', '')).upper()
+        side = order.get('side')
+        try:
+            qty = float(order.get('qty'))
+        except (TypeError, ValueError):
+            return 422, {'code': 42210000, 'message': 'qty is required'}
+        if not symbol or side not in ('buy', 'sell') or qty <= 0:
+            return 422, {'code': 42210000, 'message': 'invalid order'}
+
+        # every order fills immediately at the current fake price
+        fill = self.price(symbol)
+        position = account['positions'].get(symbol, {'qty': 0.0, 'avg_entry_price': 0.0})
+        if side == 'buy':
+            if qty * fill > account['cash']:
+                return 403, {'code': 40310000, 'message': 'insufficient buying power'}
+            total = position['qty'] + qty
+            position['avg_entry_price'] = (position['qty'] * position['avg_entry_price'] + qty * fill) / total
+            position['qty'] = total
+            account['cash'] -= qty * fill
+        else:
+            if qty > position['qty']:
+                return 403, {'code': 40310000, 'message': 'insufficient qty available for order'}
+            position['qty'] -= qty
+            account['cash'] += qty * fill
+
+        if position['qty'] > 0:
+            account['positions'][symbol] = position
+        else:
+            account['positions'].pop(symbol, None)
+
+        now = datetime.utcnow().isoformat() + 'Z'
+        record = {
+            'id': str(uuid.uuid4()),
+            'client_order_id': order.get('client_order_id') or str(uuid.uuid4()),
+            'symbol': symbol,
+            'qty': str(qty),
+            'filled_qty': str(qty),
+            'filled_avg_price': f"{fill:.2f}",
+            'side': side,
+            'type': order.get('type', 'market'),
+            'time_in_force': order.get('time_in_force', 'day'),
+            'status': 'filled',
+            'created_at': now,
+            'filled_at': now
+        }
+        account['orders'].append(record)
+        return 200, record
+
+    def journal(self, entry):
+        from_account = self.accounts.get(entry.get('from_account'))
+        to_account = self.accounts.get(entry.get('to_account'))
+        try:
+            amount = float(entry.get('amount'))
+        except (TypeError, ValueError):
+            return 422, {'code': 42210000, 'message': 'amount is required'}
+        if to_account is None:
+            return 404, {'code': 40410000, 'message': 'account not found'}
+
+        # the firm account is not tracked, it has unlimited funds
+        if from_account is not None:
+            from_account['cash'] -= amount
+        to_account['cash'] += amount
+
+        record = {
+            'id': str(uuid.uuid4()),
+            'entry_type': entry.get('entry_type', 'JNLC'),
+            'from_account': entry.get('from_account'),
+            'to_account': entry.get('to_account'),
+            'net_amount': f"{amount:.2f}",
+            'description': entry.get('description', ''),
+            'status': 'executed',
+            'settle_date': datetime.utcnow().date().isoformat(),
+            'system_date': datetime.utcnow().date().isoformat()
+        }
+        self.journals.append(record)
+        return 200, record
+
+    def snapshots(self, symbols):
+        now = time.time()
+        result = {}
+        for symbol in symbols:
+            price = self.price(symbol, now)
+            prev_close = self.price(symbol, now - 86400)
+            stamp = datetime.utcfromtimestamp(now).isoformat() + 'Z'
+            result[symbol] = {
+                'latestTrade': {'p': price, 's': 100, 't': stamp},
+                'minuteBar': {'o': price, 'h': price, 'l': price, 'c': price, 'v': 1000, 't': stamp},
+                'prevDailyBar': {'c': prev_close}
+            }
+        return 200, result
+
+    def history(self, symbol, timeframe, start=None):
+        step = HISTORY_TIMEFRAMES.get(timeframe)
+        if step is None:
+            return 400, {'error': f'unsupported timeframe {timeframe}'}
+
+        last = int(time.time()) // step * step
+        first = last - (self.history_bars - 1) * step
+        if start is not None:
+            first = max(first, int(float(start)) // step * step)
+
+        bars = []
+        for ts in range(first, last + 1, step):
+            open_ = self.price(symbol, ts)
+            close = self.price(symbol, ts + step)
+            bars.append({
+                'bucket_time': ts,
+                'open': open_,
+                'high': round(max(open_, close) * 1.002, 2),
+                'low': round(min(open_, close) * 0.998, 2),
+                'close': close,
+                'volume': 1000 + (ts // step) % 500
+            })
+        return 200, bars
+
+
+def make_handler(broker):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if not length:
+                return {}
+            try:
+                return json.loads(self.rfile.read(length))
+            except ValueError:
+                return None
+
+        def handle_any(self, method):
+            url = urlparse(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            body = self.read_json() if method in ('POST', 'PATCH') else {}
+
+            with broker.lock:
+                broker.requests += 1
+            delay = broker.latency + broker.random.uniform(-broker.jitter, broker.jitter)
+            if delay > 0:
+                time.sleep(delay)
+            if broker.error_rate and broker.random.random() < broker.error_rate:
+                return self.send_json(broker.error_status, {'code': broker.error_status, 'message': 'injected error'})
+            if body is None:
+                return self.send_json(400, {'code': 40010000, 'message': 'invalid json'})
+
+            status, result = self.route(method, url.path, query, body)
+            if status == 204:
+                self.send_response(204)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self.send_json(status, result)
+
+        def route(self, method, path, query, body):
+            if path == '/history' and method == 'GET':
+                symbol = query.get('symbol')
+                if not symbol:
+                    return 400, {'error': 'symbol is required'}
+                return broker.history(symbol.upper(), query.get('timeframe', '1h'), query.get('start'))
+
+            if path == '/v2/stocks/snapshots' and method == 'GET':
+                symbols = [s.strip().upper() for s in query.get('symbols', '').split(',') if s.strip()]
+                return broker.snapshots(symbols)
+
+            with broker.lock:
+                if path == '/v1/accounts' and method == 'POST':
+                    account_id = broker.new_account()
+                    broker.accounts[account_id]['contact'] = body.get('contact', {})
+                    return 200, {'id': account_id, 'status': 'ACTIVE', 'contact': body.get('contact', {})}
+
+                if path == '/v1/accounts' and method == 'GET':
+                    needle = query.get('query', '').lower()
+                    return 200, [
+                        {'id': a['id'], 'status': 'ACTIVE', 'contact': a.get('contact', {})}
+                        for a in broker.accounts.values()
+                        if needle in a.get('contact', {}).get('email_address', '').lower()
+                    ]
+
+                if path == '/v1/journals' and method == 'POST':
+                    return broker.journal(body)
+
+                if path == '/v1/journals/batch' and method == 'POST':
+                    results = []
+                    for entry in body.get('entries', []):
+                        status, journal = broker.journal(dict(entry, entry_type=body.get('entry_type', 'JNLC'), from_account=body.get('from_account'), description=body.get('description', '')))
+                        if status != 200:
+                            journal = {'to_account': entry.get('to_account'), 'status': 'rejected', 'error_message': journal['message']}
+                        results.append(journal)
+                    return 200, results
+
+                if path == '/v1/journals' and method == 'GET':
+                    status = query.get('status')
+                    before = query.get('before')
+                    fields = ('to_account', 'from_account', 'entry_type')
+                    return 200, [
+                        j for j in broker.journals
+                        if (status is None or j['status'] == status) and (before is None or j['system_date'] < before)
+                        and all(query.get(f) in (None, j[f]) for f in fields)
+                    ]
+
+                match = re.fullmatch(r'/v1/journals/([^/]+)', path)
+                if match and method == 'DELETE':
+                    for j in broker.journals:
+                        if j['id'] == match.group(1) and j['status'] in ('queued', 'pending'):
+                            j['status'] = 'canceled'
+                            return 204, None
+                    return 404, {'code': 40410000, 'message': 'journal not found'}
+
+                if path == '/v1/transfers' and method == 'GET':
+                    status = query.get('status')
+                    offset = int(query.get('offset', 0))
+                    limit = int(query.get('limit', 100))
+                    return 200, [t for t in broker.transfers if status is None or t['status'] == status][offset:offset + limit]
+
+                match = re.fullmatch(r'/v1/transfers/([^/]+)', path)
+                if match and method == 'DELETE':
+                    for t in broker.transfers:
+                        if t['id'] == match.group(1) and t['status'] in ('queued', 'pending'):
+                            t['status'] = 'canceled'
+                            return 204, None
+                    return 404, {'code': 40410000, 'message': 'transfer not found'}
+
+                match = re.fullmatch(r'/v1/trading/accounts/([^/]+)/(account|positions|orders)', path)
+                if match:
+                    account = broker.accounts.get(match.group(1))
+                    if account is None:
+                        return 404, {'code': 40410000, 'message': 'account not found'}
+                    resource = match.group(2)
+                    if resource == 'account' and method == 'GET':
+                        return 200, broker.account_json(account)
+                    if resource == 'positions' and method == 'GET':
+                        return 200, broker.positions_json(account)
+                    if resource == 'orders' and method == 'GET':
+                        limit = int(query.get('limit', 50))
+                        return 200, list(reversed(account['orders']))[:limit]
+                    if resource == 'orders' and method == 'POST':
+                        return broker.place_order(account, body)
+
+            return 404, {'code': 40400000, 'message': 'endpoint not found'}
+
+        def do_GET(self):
+            self.handle_any('GET')
+
+        def do_POST(self):
+            self.handle_any('POST')
+
+        def do_DELETE(self):
+            self.handle_any('DELETE')
+
+    return Handler
+
+
+def start_server(broker, host='127.0.0.1', port=8001):
+    server = ThreadingHTTPServer((host, port), make_handler(broker))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='fakebroker', daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local fake Alpaca Broker API and history backend')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.02, help='random +/- seconds on top of latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=500, help='status code used for injected errors')
+    parser.add_argument('--history-bars', type=int, default=500, help='bars returned per history series')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    broker = FakeBroker(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        history_bars=args.history_bars,
+        seed=args.seed
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(broker))
+    server.daemon_threads = True
+    print(f"Fake broker listening on http://{args.host}:{args.port}")
+    print(f"  ALPACA_BROKER_URL=http://{args.host}:{args.port}/v1")
+    print(f"  ALPACA_DATA_URL=http://{args.host}:{args.port}/v2")
+    print(f"  TAILSCALE_HISTORY_URL=http://{args.host}:{args.port}/history")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nServed {broker.requests} requests.")
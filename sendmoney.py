@@ -1,18 +1,56 @@
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
 import requests
-from requests.auth import HTTPBasicAuth
 
-API_KEY = "CKWZXV6O4C7P5ZPGKPZ72KYZQH"       
-API_SECRET = "GeUEsQeEdVqbp1FRorhfVZJJgQ4fviGahFmhyVXGuek7" 
+from upstream import PRIORITY_LOW, AlpacaClient, CircuitOpenError, RateLimitTimeout, UpstreamScheduler, journal_entry, submit_journal_batch
+
+# settings come from the process environment only, .env is not read, so without
+# exported overrides these are the sandbox defaults below
+
+API_KEY = os.getenv("ALPACA_BROKER_KEY", "CKWZXV6O4C7P5ZPGKPZ72KYZQH")
+API_SECRET = os.getenv("ALPACA_BROKER_SECRET", "GeUEsQeEdVqbp1FRorhfVZJJgQ4fviGahFmhyVXGuek7")
 
 # firm sweep account id
-FIRM_ACCOUNT_ID = "ea8b4d97-ec46-399b-b088-e88936c3ecaf" 
+FIRM_ACCOUNT_ID = os.getenv("ALPACA_FUNDING_ACCOUNT_ID", "ea8b4d97-ec46-399b-b088-e88936c3ecaf")
+
+BASE_URL = os.getenv("ALPACA_BROKER_URL", "https://broker-api.sandbox.alpaca.markets/v1")
+
+DEFAULT_AMOUNT = "50000"
+
+# Funds one account interactively:
+#   python sendmoney.py
+#
+# Or many from a CSV of account_id[,amount] rows (or - for stdin), writing one result row
+# per account to the report so an interrupted run can be picked up with --resume:
+#   python sendmoney.py --bulk accounts.csv --report funding.csv
+#   python sendmoney.py --bulk accounts.csv --report funding.csv --resume
+
+REPORT_FIELDS = ['account_id', 'amount', 'status', 'journal_id', 'journal_status', 'error', 'finished_at']
+
+# draws from the same rate limit bucket file as the app, bulk runs go at low priority so they can't starve live orders
+RATE_LIMIT = float(os.getenv('ALPACA_RATE_LIMIT', '1000'))
+RATE_STATE_DIR = os.getenv('ALPACA_RATE_STATE_DIR', tempfile.gettempdir())
+
+scheduler = UpstreamScheduler('alpaca', RATE_LIMIT, state_dir=RATE_STATE_DIR) if RATE_LIMIT > 0 else None
+client = AlpacaClient(BASE_URL, API_KEY, API_SECRET, name='sendmoney', scheduler=scheduler)
+
+
+class BatchUnsupported(Exception):
+    pass
 
-BASE_URL = "https://broker-api.sandbox.alpaca.markets/v1"
 
 def send_money():
     # 1. ask for account id
     target_account_id = input("\n Enter the User Account ID: ").strip()
-    
+
     if not target_account_id:
         print(" Error: No Account ID entered.")
         return
@@ -20,21 +58,11 @@ def send_money():
     print(f"\n Sending $50,000 from Firm Wallet to {target_account_id}...")
 
     # 2. construct the instant journal
-    payload = {
-        "entry_type": "JNLC",
-        "from_account": FIRM_ACCOUNT_ID,
-        "to_account": target_account_id,
-        "amount": "50000",
-        "description": "Manual Admin Top-up"
-    }
+    payload = journal_entry(target_account_id, DEFAULT_AMOUNT, "Manual Admin Top-up", from_account=FIRM_ACCOUNT_ID)
 
     # 3. send the request
     try:
-        response = requests.post(
-            f"{BASE_URL}/journals", 
-            json=payload, 
-            auth=HTTPBasicAuth(API_KEY, API_SECRET)
-        )
+        response = client.post("/journals", json=payload)
 
         # 4. handle response
         if response.status_code == 200:
@@ -45,9 +73,203 @@ def send_money():
             print("\nFAILED.")
             print(f"Status Code: {response.status_code}")
             print(f"Error Message: {response.text}")
-            
+
     except Exception as e:
         print(f"\n Script Error: {e}")
 
+
+def read_entries(source, default_amount):
+    handle = sys.stdin if source == '-' else open(source, newline='')
+    entries = []
+    seen = set()
+    try:
+        for line_no, row in enumerate(csv.reader(handle), 1):
+            row = [cell.strip() for cell in row]
+            if not row or not row[0] or row[0].startswith('#') or row[0].lower() == 'account_id':
+                continue
+            account_id = row[0]
+            amount = row[1] if len(row) > 1 and row[1] else default_amount
+            try:
+                if float(amount) <= 0:
+                    raise ValueError
+            except ValueError:
+                sys.exit(f"Line {line_no}: invalid amount {amount!r} for {account_id}")
+            if account_id in seen:
+                print(f"Line {line_no}: {account_id} is listed more than once, only the first row is funded")
+                continue
+            seen.add(account_id)
+            entries.append((account_id, amount))
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+    return entries
+
+
+# accounts a previous run already dealt with, going by the last row written for each
+def load_finished(report_path, retry_unknown):
+    if not os.path.exists(report_path):
+        return set()
+    last = {}
+    with open(report_path, newline='') as f:
+        for row in csv.DictReader(f):
+            last[row['account_id']] = row['status']
+    skip = {'funded'} if retry_unknown else {'funded', 'unknown'}
+    return {account_id for account_id, status in last.items() if status in skip}
+
+
+class Report:
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.handle = open(path, 'a', newline='')
+        self.writer = csv.DictWriter(self.handle, fieldnames=REPORT_FIELDS)
+        self.lock = threading.Lock()
+        if new:
+            self.writer.writeheader()
+
+    def write(self, row):
+        row['finished_at'] = datetime.now(timezone.utc).isoformat()
+        with self.lock:
+            self.writer.writerow(row)
+            # flushed per row so a crash never loses a funded account
+            self.handle.flush()
+
+    def close(self):
+        self.handle.close()
+
+
+def result_row(account_id, amount, status, journal=None, error=''):
+    journal = journal or {}
+    return {
+        'account_id': account_id,
+        'amount': amount,
+        'status': status,
+        'journal_id': journal.get('id', ''),
+        'journal_status': journal.get('status', ''),
+        'error': error
+    }
+
+
+# funded: alpaca accepted it, failed: it was definitely not sent or was rejected,
+# unknown: the request may have gone through, so --resume leaves it alone unless told otherwise
+def fund_batch(chunk, args):
+    try:
+        response = submit_journal_batch(client, chunk, args.description, from_account=args.from_account, priority=PRIORITY_LOW)
+    except (CircuitOpenError, RateLimitTimeout) as e:
+        return [result_row(a, amount, 'failed', error=str(e)) for a, amount in chunk]
+    except requests.RequestException as e:
+        return [result_row(a, amount, 'unknown', error=str(e)) for a, amount in chunk]
+
+    if response.status_code in (404, 405, 501):
+        raise BatchUnsupported(response.status_code)
+    if response.status_code >= 500:
+        return [result_row(a, amount, 'unknown', error=f"{response.status_code} {response.text}") for a, amount in chunk]
+    if response.status_code != 200:
+        return [result_row(a, amount, 'failed', error=f"{response.status_code} {response.text}") for a, amount in chunk]
+
+    journals = response.json()
+    by_account = {j.get('to_account'): j for j in journals}
+    rows = []
+    for i, (account_id, amount) in enumerate(chunk):
+        journal = by_account.get(account_id) or (journals[i] if i < len(journals) else None)
+        if journal is None:
+            rows.append(result_row(account_id, amount, 'unknown', error='missing from batch response'))
+        elif journal.get('error_message') or journal.get('status') in ('rejected', 'canceled'):
+            rows.append(result_row(account_id, amount, 'failed', journal, journal.get('error_message', '')))
+        else:
+            rows.append(result_row(account_id, amount, 'funded', journal))
+    return rows
+
+
+def fund_one(account_id, amount, args):
+    payload = journal_entry(account_id, amount, args.description, from_account=args.from_account)
+    try:
+        response = client.post("/journals", json=payload, priority=PRIORITY_LOW)
+    except (CircuitOpenError, RateLimitTimeout) as e:
+        return result_row(account_id, amount, 'failed', error=str(e))
+    except requests.RequestException as e:
+        return result_row(account_id, amount, 'unknown', error=str(e))
+
+    if response.status_code in (200, 201):
+        return result_row(account_id, amount, 'funded', response.json())
+    status = 'unknown' if response.status_code >= 500 else 'failed'
+    return result_row(account_id, amount, status, error=f"{response.status_code} {response.text}")
+
+
+def fund_with_pool(entries, args, report, tally):
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(fund_one, account_id, amount, args) for account_id, amount in entries]
+        for future in as_completed(futures):
+            record(future.result(), report, tally)
+
+
+def record(row, report, tally):
+    report.write(row)
+    tally[row['status']] = tally.get(row['status'], 0) + 1
+    if row['status'] == 'funded':
+        tally['amount'] += float(row['amount'])
+    else:
+        print(f"{row['status'].upper()} {row['account_id']}: {row['error']}")
+
+
+def run_bulk(args):
+    entries = read_entries(args.bulk, args.amount)
+    finished = load_finished(args.report, args.retry_unknown) if args.resume else set()
+    pending = [entry for entry in entries if entry[0] not in finished]
+    print(f"{len(entries)} accounts read, {len(entries) - len(pending)} already done, {len(pending)} to fund from {args.from_account}")
+
+    if args.dry_run:
+        for account_id, amount in pending:
+            print(f"  {account_id}  {amount}")
+        return 0
+
+    report = Report(args.report)
+    tally = {'funded': 0, 'failed': 0, 'unknown': 0, 'amount': 0.0}
+    started = time.perf_counter()
+    try:
+        use_batch = not args.no_batch
+        for offset in range(0, len(pending), args.chunk_size):
+            chunk = pending[offset:offset + args.chunk_size]
+            if use_batch:
+                try:
+                    for row in fund_batch(chunk, args):
+                        record(row, report, tally)
+                except BatchUnsupported as e:
+                    print(f"Batch journals not available ({e}), falling back to {args.workers} concurrent requests")
+                    use_batch = False
+            if not use_batch:
+                fund_with_pool(chunk, args, report, tally)
+            print(f"{min(offset + len(chunk), len(pending))}/{len(pending)} processed")
+    except KeyboardInterrupt:
+        print("\nInterrupted, run again with --resume to continue.")
+    finally:
+        report.close()
+
+    elapsed = time.perf_counter() - started
+    processed = tally['funded'] + tally['failed'] + tally['unknown']
+    print("\n--- SUMMARY ---")
+    print(f"Funded:   {tally['funded']} (${tally['amount']:,.2f})")
+    print(f"Failed:   {tally['failed']}")
+    print(f"Unknown:  {tally['unknown']} (check these before retrying with --resume --retry-unknown)")
+    print(f"Elapsed:  {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.1f} accounts/s)")
+    print(f"Report:   {args.report}")
+    return 1 if tally['failed'] or tally['unknown'] else 0
+
+
 if __name__ == "__main__":
-    send_money()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Fund Alpaca accounts from the firm account')
+    parser.add_argument('--bulk', metavar='CSV', help='CSV of account_id[,amount] rows, - for stdin')
+    parser.add_argument('--report', default='funding_report.csv', help='CSV the per account results are appended to')
+    parser.add_argument('--resume', action='store_true', help='skip accounts the report says were already funded')
+    parser.add_argument('--retry-unknown', action='store_true', help='with --resume, also retry accounts whose result was unknown')
+    parser.add_argument('--amount', default=DEFAULT_AMOUNT, help='amount for rows without one')
+    parser.add_argument('--from-account', default=FIRM_ACCOUNT_ID)
+    parser.add_argument('--description', default='Cohort Funding')
+    parser.add_argument('--chunk-size', type=int, default=50, help='journals per batch request')
+    parser.add_argument('--no-batch', action='store_true', help='send one journal per request instead of batches')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent requests when not batching')
+    parser.add_argument('--dry-run', action='store_true', help='only list the accounts that would be funded')
+    args = parser.parse_args()
+
+    if args.bulk:
+        sys.exit(run_bulk(args))
+    send_money()
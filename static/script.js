@@ -79,15 +79,21 @@ if (searchInput && searchResults) {
                 searchResults.classList.remove('hidden');
                 console.log('Searching for:', query);
 
-                // Convert query to lowercase for case-insensitive search
-                const searchQuery = query.toLowerCase();
-
-                // Filter through stocks
+                // Ranked matches come from the server index, prices from the stocks already loaded
                 const stocksToSearch = window.allStocks || window.defaultStocks || [];
-                const results = stocksToSearch.filter(stock => {
-                    // Search in both symbol and name
-                    return stock.symbol.toLowerCase().includes(searchQuery) ||
-                        stock.name.toLowerCase().includes(searchQuery);
+                const bySymbol = new Map(stocksToSearch.map(stock => [stock.symbol, stock]));
+                const response = await fetch(`/api/search?q=${encodeURIComponent(query)}&limit=20`);
+                if (!response.ok) throw new Error(`Search failed: ${response.status}`);
+                const data = await response.json();
+                if (query !== searchInput.value.trim()) return; // a newer keystroke owns the dropdown
+
+                const results = data.results.map(match => bySymbol.get(match.symbol) || {
+                    ...match,
+                    logoUrl: `https://img.logo.dev/ticker/${match.symbol}?token=${window.LOGO_API_KEY}&size=64&format=png&theme=dark&retina=true`,
+                    price: null,
+                    change: null,
+                    changePercent: null,
+                    isPositive: true
                 });
 
                 console.log('Search results:', results.length, 'matches found');
@@ -680,7 +686,8 @@ async function loadWatchlistItems(watchlistId) {
                 `;
 
     try {
-        const response = await fetch(`/api/watchlist/${watchlistId}`);
+        // quotes=1 returns prices with the items in one request
+        const response = await fetch(`/api/watchlist/${watchlistId}?quotes=1`);
         const data = await response.json();
 
         if (data.items && data.items.length > 0) {
@@ -950,7 +957,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // function to add a stock to the list
     async function addStockToList(symbol) {
         try {
-            const response = await fetch(`${BACKEND_URL}/api/search?q=${encodeURIComponent(symbol)}`);
+            const response = await fetch(`/api/search?q=${encodeURIComponent(symbol)}&limit=1`);
             const data = await response.json();
 
             if (data.error) {
@@ -958,7 +965,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 return;
             }
 
-            const stockData = data.result?.find(s => s.symbol === symbol);
+            const stockData = data.results?.find(s => s.symbol === symbol);
             if (!stockData) {
                 showError('Stock not found');
                 return;
@@ -1376,7 +1383,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // Fetch Data
         try {
-            const chartData = await fetchHistory(symbol, timeframe);
+            // when the whole series is fitted into view there is no point sending more candles than fit the chart
+            const chartData = await fetchHistory(symbol, timeframe, rangeSeconds > 0 ? null : container.clientWidth);
 
             // Sort by time (ascending) just in case
             chartData.sort((a, b) => a.time - b.time);
@@ -2138,6 +2146,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // Initial Balance Load
     updateDashboardBalance();
+    subscribeAccountStream();
 });
 
 // ==========================================
@@ -2145,7 +2154,6 @@ document.addEventListener('DOMContentLoaded', () => {
 // ==========================================
 async function updateDashboardBalance() {
     const balanceEl = document.getElementById('balance');
-    const orderBalanceDetail = document.getElementById('order-balance-display'); // Also update in modal if exists
 
     // Always fetch positions to update the UI below chart
     fetchOpenPositions();
@@ -2156,22 +2164,62 @@ async function updateDashboardBalance() {
         const res = await fetch('/api/account_info');
         if (res.ok) {
             const data = await res.json();
-            const equity = parseFloat(data.equity || 0);
-
-            // Update Header Balance
-            balanceEl.textContent = equity.toLocaleString('en-US', { minimumFractionDigits: 2, maximumFractionDigits: 2 });
-
-            // Update Order Modal Balance display if it exists
-            if (orderBalanceDetail) {
-                // Assuming modal shows full currency string e.g. "$50,000.00"
-                orderBalanceDetail.textContent = `$${equity.toLocaleString('en-US', { minimumFractionDigits: 2, maximumFractionDigits: 2 })}`;
-            }
+            renderBalance(data);
         }
     } catch (e) {
         console.error("Failed to fetch balance:", e);
     }
 }
 
+function renderBalance(data) {
+    const balanceEl = document.getElementById('balance');
+    const orderBalanceDetail = document.getElementById('order-balance-display');
+    if (!balanceEl) return;
+
+    const equity = parseFloat(data.equity || 0);
+
+    // Update Header Balance
+    balanceEl.textContent = equity.toLocaleString('en-US', { minimumFractionDigits: 2, maximumFractionDigits: 2 });
+
+    // Update Order Modal Balance display if it exists
+    if (orderBalanceDetail) {
+        // Assuming modal shows full currency string e.g. "$50,000.00"
+        orderBalanceDetail.textContent = `$${equity.toLocaleString('en-US', { minimumFractionDigits: 2, maximumFractionDigits: 2 })}`;
+    }
+}
+
+// ==========================================
+// LIVE ACCOUNT STREAM
+// ==========================================
+// The server pushes account/positions changes so the page doesn't have to poll.
+// EventSource reconnects on its own if the connection drops.
+function subscribeAccountStream() {
+    if (!window.EventSource || window.accountStream) return;
+
+    const stream = new EventSource('/api/stream');
+    window.accountStream = stream;
+
+    stream.addEventListener('account', (e) => {
+        renderBalance(JSON.parse(e.data));
+    });
+
+    stream.addEventListener('positions', (e) => {
+        const positions = JSON.parse(e.data);
+        renderOpenPositions(Array.isArray(positions) ? positions : []);
+    });
+
+    stream.addEventListener('orders', (e) => {
+        window.latestOrders = JSON.parse(e.data);
+    });
+
+    stream.onerror = () => {
+        // No trading account yet (400) closes the stream for good
+        if (stream.readyState === EventSource.CLOSED) {
+            window.accountStream = null;
+        }
+    };
+}
+
 // ==========================================
 // POSITIONS LOGIC
 // ==========================================
@@ -2411,10 +2459,11 @@ let currentChartTimeframe = '1h'; // Default
 /**
  * Fetches historical bars from the backend
  */
-async function fetchHistory(symbol, timeframe) {
+async function fetchHistory(symbol, timeframe, width) {
     try {
         // Reverting to local proxy to avoid Browser SSL/CORS issues (ERR_CERTIFICATE_TRANSPARENCY_REQUIRED)
-        const response = await fetch(`/api/history?symbol=${symbol}&timeframe=${timeframe}`);
+        const widthParam = width ? `&width=${Math.round(width)}` : '';
+        const response = await fetch(`/api/history?symbol=${symbol}&timeframe=${timeframe}${widthParam}`);
 
         // If 404 or error, we might fallback or return empty
         if (!response.ok) {
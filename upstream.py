@@ -0,0 +1,390 @@
+import base64
+import heapq
+import os
+import re
+import struct
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# shares the alpaca rate limit between worker processes, in process only without it
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# HTTP clients for Alpaca and the history backend: keep-alive sessions behind a circuit
+# breaker and an optional rate limit scheduler shared between processes. Nothing here
+# reads configuration at import time, so scripts like sendmoney.py can use it without
+# pulling in the app and its .env.
+
+# /trading/accounts/<uuid>/orders -> /trading/accounts/:id/orders to keep label counts small
+UUID_PATTERN = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+# 5xx is only retried for idempotent methods so an order is never sent twice,
+# but a 429 means alpaca rejected the request outright so any method can retry it.
+# only used by clients without a scheduler, UpstreamClient.request retries for the rest
+class AlpacaRetry(Retry):
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429 and self.total:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"{upstream} circuit open, retry in {retry_after:.0f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+# stops calling an upstream after consecutive failures, then lets a single request
+# through every reset_timeout seconds to see whether it has recovered
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            waited = time.monotonic() - self.opened_at
+            if self.state == self.OPEN and waited >= self.reset_timeout:
+                # this caller is the probe, everyone else keeps failing fast until it reports back
+                self.state = self.HALF_OPEN
+                return
+            raise CircuitOpenError(self.name, max(0.0, self.reset_timeout - waited))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+
+    # the probe never reached the upstream, let the next caller probe instead
+    def cancel_probe(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def stats(self):
+        with self._lock:
+            return {'open': int(self.state != self.CLOSED), 'failures': self.failures, 'trips': self.trips}
+
+# orders and account provisioning first, then user facing reads, then background polling
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITY_NAMES = {PRIORITY_HIGH: 'high', PRIORITY_NORMAL: 'normal', PRIORITY_LOW: 'low'}
+
+class RateLimitTimeout(requests.exceptions.ConnectionError):
+    def __init__(self, upstream, waited):
+        super().__init__(f"{upstream} rate limit queue wait exceeded {waited:.1f}s")
+        self.upstream = upstream
+        # nothing was sent, so it is safe to treat like an open circuit
+        self.retry_after = 1.0
+
+# token bucket refilled at `rate` per second up to `burst`. with a state file every
+# process on the host draws from the same bucket, the file holds (tokens, updated_at)
+# and is read and written under an exclusive flock
+class TokenBucket:
+    STATE = struct.Struct('dd')
+
+    def __init__(self, rate, burst, path=None):
+        self.rate = rate
+        self.burst = burst
+        self.path = path if fcntl is not None else None
+        self._state = (burst, time.time())
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    # opened on first use and again after a fork. a descriptor inherited from a pre-fork
+    # master shares its open file with every sibling, and flock wouldn't keep them apart
+    def _file(self):
+        if not self.path:
+            return None
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._fd
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as e:
+            print(f"Rate Limit State Error {self.path}: {e}")
+            self.path = None
+            return None
+        self._pid = pid
+        return self._fd
+
+    def _update(self, change):
+        # flock is held per open file, so threads in this process also need the lock
+        with self._lock:
+            fd = self._file()
+            if fd is None:
+                self._state = change(*self._state)
+                return self._state
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(fd, self.STATE.size, 0)
+                state = self.STATE.unpack(data) if len(data) == self.STATE.size else (self.burst, time.time())
+                state = change(*state)
+                os.pwrite(fd, self.STATE.pack(*state), 0)
+                return state
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    # takes a token if more than `reserve` would be left, otherwise returns how long to wait
+    def take(self, reserve=0.0):
+        wait = []
+
+        def change(tokens, updated_at):
+            now = time.time()
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate)
+            if tokens - 1 >= reserve:
+                return tokens - 1, now
+            wait.append((reserve + 1 - tokens) / self.rate)
+            return tokens, now
+
+        self._update(change)
+        return wait[0] if wait else 0.0
+
+    # the upstream answered 429 anyway, stop everyone for `seconds`. concurrent 429s
+    # share one hold off, the longest Retry-After wins rather than their sum
+    def drain(self, seconds):
+        def change(tokens, updated_at):
+            now = time.time()
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate)
+            return min(tokens, -seconds * self.rate), now
+
+        self._update(change)
+
+    def tokens(self):
+        return self._update(lambda tokens, updated_at: (min(self.burst, tokens + max(0.0, time.time() - updated_at) * self.rate), time.time()))[0]
+
+# hands out bucket tokens to callers in priority order. lower priorities also have to
+# leave part of the burst untouched so an order never queues behind dashboard reads
+class UpstreamScheduler:
+    def __init__(self, name, rate_per_minute, burst=20, reserve=5, state_dir=None, timeout=10, metrics=None):
+        self.name = name
+        self.metrics = metrics
+        path = os.path.join(state_dir, f"penguin-{name}.bucket") if state_dir else None
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst, path)
+        self.reserves = {PRIORITY_HIGH: 0.0, PRIORITY_NORMAL: reserve / 2.0, PRIORITY_LOW: float(reserve)}
+        self.timeout = timeout
+        self._waiting = []  # heap of [priority, seq]
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        with self._cond:
+            self._seq += 1
+            entry = [priority, self._seq]
+            heapq.heappush(self._waiting, entry)
+            # a higher priority arrival may need to take over from the current head
+            self._cond.notify_all()
+            try:
+                while True:
+                    remaining = deadline - time.perf_counter()
+                    if self._waiting[0] is entry:
+                        wait = self.bucket.take(self.reserves.get(priority, 0.0))
+                        if not wait:
+                            break
+                    else:
+                        wait = remaining
+                    if remaining <= 0:
+                        if self.metrics is not None:
+                            self.metrics.inc('penguin_upstream_queue_timeouts_total', (('upstream', self.name), ('priority', PRIORITY_NAMES.get(priority, str(priority)))))
+                        raise RateLimitTimeout(self.name, time.perf_counter() - started)
+                    self._cond.wait(min(wait, remaining))
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+        waited = time.perf_counter() - started
+        if self.metrics is not None:
+            self.metrics.observe('penguin_upstream_queue_wait_seconds', (('upstream', self.name), ('priority', PRIORITY_NAMES.get(priority, str(priority)))), waited)
+        return waited
+
+    def penalize(self, seconds):
+        self.bucket.drain(seconds)
+
+    def stats(self):
+        with self._cond:
+            waiting = len(self._waiting)
+        return {'waiting': waiting, 'tokens': round(self.bucket.tokens(), 2)}
+
+# one keep-alive session shared by every call to an upstream in this process
+class UpstreamClient:
+    def __init__(self, base_url, headers=None, pool_size=10, connect_timeout=3.05, read_timeout=10, max_retries=3, backoff=0.3, name='upstream', verify=True, scheduler=None, failure_threshold=5, reset_timeout=30, recorder=None):
+        self.name = name
+        self.scheduler = scheduler
+        # recorder(upstream, operation, started, status) is called once per call
+        self.recorder = recorder
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.headers = headers or {}
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        if scheduler is None:
+            retry = AlpacaRetry(
+                total=max_retries,
+                backoff_factor=backoff,
+                status_forcelist=RETRY_STATUSES,
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+        else:
+            # status retries happen in request() instead, so every attempt takes a rate limit
+            # token, urllib3 only retries connections that failed before anything was sent
+            retry = Retry(
+                total=max_retries,
+                backoff_factor=backoff,
+                status_forcelist=[],
+                respect_retry_after_header=False,
+                raise_on_status=False
+            )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.verify = verify
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # writes (orders, account provisioning, journals) default to high priority, reads to normal
+    def request(self, method, path, priority=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        operation = f"{method} {UUID_PATTERN.sub(':id', path)}"
+        started = time.perf_counter()
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self._record(operation, started, 'circuit_open')
+            raise
+        if self.scheduler is not None and priority is None:
+            priority = PRIORITY_NORMAL if method == 'GET' else PRIORITY_HIGH
+
+        attempt = 0
+        response = None
+        while True:
+            if self.scheduler is not None:
+                try:
+                    self.scheduler.acquire(priority)
+                except RateLimitTimeout:
+                    if response is not None:
+                        # a retry ran out of time, the caller gets the last real answer
+                        break
+                    self.breaker.cancel_probe()
+                    self._record(operation, started, 'queue_timeout')
+                    raise
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            except Exception:
+                self.breaker.record_failure()
+                self._record(operation, started, 'error')
+                raise
+            if response.status_code == 429 and self.scheduler is not None:
+                # our budget is out of step with alpaca's, back every process off,
+                # a retry then waits in acquire for the bucket to refill
+                self.scheduler.penalize(self._retry_after(response))
+            if self.scheduler is None or not self._should_retry(method, response.status_code) or attempt >= self.max_retries:
+                break
+            attempt += 1
+            if response.status_code != 429:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            response.close()
+
+        # 4xx is the caller's problem, only a failing upstream counts against the breaker
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        self._record(operation, started, str(response.status_code))
+        return response
+
+    # 5xx is only retried for idempotent methods so an order is never sent twice
+    @staticmethod
+    def _should_retry(method, status_code):
+        if status_code == 429:
+            return True
+        return status_code in RETRY_STATUSES and method.upper() in Retry.DEFAULT_ALLOWED_METHODS
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers.get('Retry-After') or 1)
+        except ValueError:
+            return 1.0
+
+    def _record(self, operation, started, status):
+        if self.recorder is not None:
+            self.recorder(self.name, operation, started, status)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+class AlpacaClient(UpstreamClient):
+    def __init__(self, base_url, key, secret, **kwargs):
+        kwargs.setdefault('name', 'alpaca')
+        headers = {
+            "Authorization": f"Basic {base64.b64encode(f'{key}:{secret}'.encode()).decode()}"
+        }
+        super().__init__(base_url, headers=headers, **kwargs)
+
+# Broker API journal payloads
+
+def format_amount(amount):
+    return f"{float(amount):.2f}".rstrip('0').rstrip('.')
+
+def journal_entry(to_account, amount, description, from_account):
+    return {
+        "entry_type": "JNLC",
+        "from_account": from_account,
+        "to_account": to_account,
+        "amount": format_amount(amount),
+        "description": description
+    }
+
+# one request for many JNLC journals out of the same account, the response has
+# one journal per entry with an error_message on the ones that were rejected
+def submit_journal_batch(client, entries, description, from_account, priority=None):
+    payload = {
+        "entry_type": "JNLC",
+        "from_account": from_account,
+        "description": description,
+        "entries": [{"to_account": to_account, "amount": format_amount(amount)} for to_account, amount in entries]
+    }
+    return client.post("/journals/batch", json=payload, priority=priority)